@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import math
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select, func, Integer
+
+from src import db, repo, columnar
+from src.columnar import columnar_store
+from src.loader import load_db_file
+from src.models import TransactionModel
+
+FUNCTIONS = ('get_totals', 'get_cashflow', 'get_burn_rate', 'get_subcategory_amounts', 'get_category_amounts')
+
+
+def is_close(a, b, path=''):
+    if isinstance(a, dict) and isinstance(b, dict):
+        if a.keys() != b.keys():
+            return False, f'{path}: keys {sorted(a.keys())} != {sorted(b.keys())}'
+        for key in a:
+            ok, where = is_close(a[key], b[key], f'{path}.{key}')
+            if not ok:
+                return ok, where
+        return True, ''
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False, f'{path}: {len(a)} items != {len(b)} items'
+        for i, (item_a, item_b) in enumerate(zip(a, b)):
+            ok, where = is_close(item_a, item_b, f'{path}[{i}]')
+            if not ok:
+                return ok, where
+        return True, ''
+    if isinstance(a, float) or isinstance(b, float):
+        if a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6):
+            return True, ''
+    return a == b, f'{path}: {a!r} != {b!r}'
+
+
+async def get_timeframes(session):
+    year = func.cast(func.strftime('%Y', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer)
+    month = func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer)
+    res = await session.execute(select(year, month).distinct().order_by(year, month))
+    months = [i._tuple() for i in res]
+    return [(y, None) for y in sorted({y for y, _ in months})] + months
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Checks that the SQL and the columnar backends give the same answers '
+                                                 'for every year and month of a prepared DB')
+    parser.add_argument('db_file', help='prepared DB file')
+    args = parser.parse_args()
+
+    await load_db_file(args.db_file)
+    timings = {'sql': 0.0, 'columnar': 0.0}
+    failures = 0
+    async with db.SessionLocal() as session:
+        started = time.perf_counter()
+        await columnar_store.load(session)
+        print(f'Columnar store loaded in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        for year, month in await get_timeframes(session):
+            for name in FUNCTIONS:
+                results = {}
+                for backend, module in (('sql', repo), ('columnar', columnar)):
+                    started = time.perf_counter()
+                    results[backend] = jsonable_encoder(await getattr(module, name)(session, year, month))
+                    timings[backend] += time.perf_counter() - started
+
+                ok, where = is_close(results['sql'], results['columnar'])
+                if not ok:
+                    failures += 1
+                    print(f'{name}(y={year}, m={month}) differs at {where}')
+
+    await db.engine.dispose()
+    print(f'sql {timings["sql"] * 1000:.1f} ms, columnar {timings["columnar"] * 1000:.1f} ms, {failures} mismatches')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import app_data as app_data_module
+from src import db
+from src.app_data import AppData, FALLBACK_RATES
+from src.utils import get_exchange_rate_date
+
+STUB_RATES = {'USD': 39.5, 'EUR': 43.25, 'GBP': 51.0, 'PLN': 10.1}
+TIMEOUT = 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.hanging:
+            self.server.released.wait(TIMEOUT * 5)
+            return
+
+        body = json.dumps({'exchangeRate': [{'currency': currency, 'saleRateNB': rate}
+                                            for currency, rate in STUB_RATES.items()]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.hanging = False
+    server.released = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def max_loop_lag(task: asyncio.Task) -> float:
+    lag = 0.0
+    while not task.done():
+        started = time.perf_counter()
+        await asyncio.sleep(0.05)
+        lag = max(lag, time.perf_counter() - started - 0.05)
+    return lag
+
+
+async def check_hanging_api(server):
+    server.hanging = True
+    app_data = AppData()
+    async with db.create_session() as session:
+        started = time.perf_counter()
+        await app_data.get_exchange_rates(session, fetch=False)
+        startup = time.perf_counter() - started
+    assert not server.requests, 'startup must not call the bank API'
+    assert startup < 0.5, f'startup took {startup:.2f} s'
+
+    refresher = asyncio.create_task(app_data.refresh_exchange_rates())
+    lag = await max_loop_lag(asyncio.create_task(asyncio.sleep(TIMEOUT + 0.5)))
+    refresher.cancel()
+
+    assert len(server.requests) == 1, 'the background refresh must call the bank API'
+    assert lag < 0.25, f'the event loop stalled for {lag:.2f} s'
+    assert app_data.exchange_rates_date is None, 'a hung API must leave the fallback rates in place'
+    assert app_data.exchange_rates['USD']['UAH'] == FALLBACK_RATES['USD']
+    print(f'hanging stub: startup {startup * 1000:.0f} ms, max event loop lag {lag * 1000:.0f} ms '
+          f'during the {TIMEOUT} s timeout, fallback rates kept')
+    server.released.set()
+
+
+async def check_responding_api(server):
+    server.hanging = False
+    server.requests.clear()
+    app_data = AppData()
+    async with db.create_session() as session:
+        rates = await app_data.get_exchange_rates(session)
+
+    rates_date = get_exchange_rate_date()
+    assert len(server.requests) == 1
+    assert rates_date.strftime('%d.%m.%Y') in server.requests[0]
+    assert app_data.exchange_rates_date == rates_date
+    assert rates['USD']['UAH'] == STUB_RATES['USD']
+    assert os.path.isfile(app_data_module.get_cached_rates_file(rates_date))
+    print(f'responding stub: USD/UAH {rates["USD"]["UAH"]}, cached for {rates_date}')
+
+
+async def check_restart_reads_cache(server):
+    server.hanging = True
+    server.requests.clear()
+    app_data = AppData()
+    async with db.create_session() as session:
+        started = time.perf_counter()
+        rates = await app_data.get_exchange_rates(session)
+        elapsed = time.perf_counter() - started
+
+    assert not server.requests, 'cached rates must not be fetched again'
+    assert app_data.exchange_rates_date == get_exchange_rate_date()
+    assert rates['USD']['UAH'] == STUB_RATES['USD']
+    print(f'restart: rates read from the cache in {elapsed * 1000:.0f} ms without calling the stub')
+    server.released.set()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Checks exchange rate fetching against a local stub of the '
+                                                 'bank API: a hanging API, a responding one and a restart '
+                                                 'that reads the on-disk cache')
+    parser.add_argument('db_file', help='prepared DB file')
+    args = parser.parse_args()
+
+    server = start_stub_server()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        app_data_module.PB_EXCHANGE_ENDPOINT = f'http://127.0.0.1:{server.server_port}/exchange_rates?date={{}}'
+        app_data_module.EXCHANGE_RATES_PATH = cache_dir
+        app_data_module.EXCHANGE_RATES_TIMEOUT = TIMEOUT
+        await db.swap_engine(args.db_file)
+        try:
+            await check_hanging_api(server)
+            server.released.clear()
+            await check_responding_api(server)
+            await check_restart_reads_cache(server)
+        finally:
+            await db.engine.dispose()
+            server.shutdown()
+    print('OK')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
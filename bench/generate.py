@@ -0,0 +1,133 @@
+import argparse
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta, date
+
+BACKUP_ID = 2
+DEFAULT_CURRENCY_ID = 10057
+CURRENCY_RATES = {10057: 1, 10051: 41.2, 10002: 45.5}
+ACCOUNT_CURRENCY_IDS = (10057, 10057, 10051, 10002)
+SCHEDULED_DAYS = 3
+
+SOURCE_SCHEMA = '''
+create table ba (_id integer primary key);
+create table de (_id integer, _b_i integer, _ty integer, _c_i integer, _na text, _a_m_b text, _a_m_l real,
+                 _a_m_g real, _a_i_i_b integer, _a_i_i_e integer, _a_o integer, _ic integer, _co integer,
+                 _ar integer, _pi integer);
+create table tr (_id integer, _b_i integer, _ty integer, _da integer, _cr_i integer, _a_i integer, _d_i integer,
+                 _a_m real, _d_m real, _c_f real, _co text, _sch integer);
+'''
+
+
+def generate_accounts(rnd: random.Random, count: int):
+    accounts = [(1, BACKUP_ID, 4, DEFAULT_CURRENCY_ID, 'All accounts', '0', 0, 0, 0, 1, 0, 0, 0, 0, None)]
+    for i in range(count):
+        currency_id = ACCOUNT_CURRENCY_IDS[i % len(ACCOUNT_CURRENCY_IDS)]
+        accounts.append((100 + i, BACKUP_ID, i % 2, currency_id, f'Account {i}', str(rnd.randint(0, 5000)), 0, 0,
+                         int(i % 5 != 4), 1, i, 1, rnd.randint(0, 2 ** 24), int(i % 7 == 6), None))
+    return accounts
+
+
+def generate_categories(rnd: random.Random, count: int, depth: int):
+    roots = max(1, count // 4)
+    categories = []
+    levels = []
+    for i in range(count):
+        parent_index = None
+        if i >= roots:
+            parent_index = i - roots
+            if levels[parent_index] >= depth - 1:
+                parent_index = i % roots
+        levels.append(levels[parent_index] + 1 if parent_index is not None else 0)
+
+        # the first root and its subtree are income categories, the rest are expense ones
+        category_type = int(i % roots != 0)
+        parent_id = 1000 + parent_index if parent_index is not None else None
+        categories.append((1000 + i, BACKUP_ID, category_type, 0, f'Category {i}', None, 0, 0, 0, None, 0, 1,
+                           rnd.randint(0, 2 ** 24), 0, parent_id))
+    return categories
+
+
+def generate_transactions(rnd: random.Random, accounts: list, categories: list, start: date, end: date,
+                          per_day: int):
+    account_currencies = [(account[0], account[3]) for account in accounts[1:]]
+    expense_categories = [category[0] for category in categories if category[2] == 1]
+    income_categories = [category[0] for category in categories if category[2] == 0]
+
+    transactions = []
+    day = datetime(start.year, start.month, start.day)
+    while day.date() <= end + timedelta(days=SCHEDULED_DAYS):
+        is_scheduled = int(day.date() > end)
+        for _ in range(rnd.randint(0, per_day * 2)):
+            timestamp = int((day + timedelta(seconds=rnd.randint(0, 86399))).timestamp() * 1000)
+            account_id, currency_id = rnd.choice(account_currencies)
+            rate = CURRENCY_RATES[currency_id]
+            kind = rnd.random()
+            if kind < 0.8:
+                amount = round(rnd.expovariate(1 / 300) * (40 if rnd.random() < 0.01 else 1), 2)
+                row = (0, account_id, rnd.choice(expense_categories), amount, round(amount * rate, 2), rate, 'c')
+            elif kind < 0.92:
+                amount = round(rnd.expovariate(1 / 3000), 2)
+                row = (1, account_id, rnd.choice(income_categories), amount, round(amount * rate, 2), rate, None)
+            else:
+                destination_id, destination_currency_id = rnd.choice(account_currencies)
+                if destination_id == account_id:
+                    continue
+                amount = round(rnd.expovariate(1 / 1000), 2)
+                destination_amount = round(amount * rate / CURRENCY_RATES[destination_currency_id], 2)
+                row = (0, account_id, destination_id, amount, destination_amount, 1, None)
+
+            transaction_type, account_id, destination_id, amount, destination_amount, rate, comment = row
+            transactions.append((len(transactions) + 1, BACKUP_ID, transaction_type, timestamp, 0, account_id,
+                                 destination_id, amount, destination_amount, rate, comment, is_scheduled))
+        day += timedelta(days=1)
+
+    return transactions
+
+
+def generate(path: str, years: int = 1, accounts: int = 10, per_day: int = 8, categories: int = 20,
+             category_depth: int = 2, end: date = None, seed: int = 0) -> int:
+    rnd = random.Random(seed)
+    end = end or date.today()
+    start = end - timedelta(days=round(365.25 * years))
+
+    account_rows = generate_accounts(rnd, accounts)
+    category_rows = generate_categories(rnd, categories, category_depth)
+    transaction_rows = generate_transactions(rnd, account_rows, category_rows, start, end, per_day)
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SOURCE_SCHEMA)
+        conn.executemany('insert into ba values (?)', [(BACKUP_ID - 1,), (BACKUP_ID,)])
+        conn.executemany(f'insert into de values ({", ".join("?" * 15)})', account_rows + category_rows)
+        conn.executemany(f'insert into tr values ({", ".join("?" * 12)})', transaction_rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return len(transaction_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic backup in the raw de/tr/ba schema '
+                                                 'that prepare_data expects')
+    parser.add_argument('output', help='backup file to write, e.g. /app/data/backup_1.bak')
+    parser.add_argument('-y', '--years', type=int, default=1)
+    parser.add_argument('-a', '--accounts', type=int, default=10)
+    parser.add_argument('-t', '--per-day', type=int, default=8, help='average transactions per day')
+    parser.add_argument('-c', '--categories', type=int, default=20)
+    parser.add_argument('--category-depth', type=int, default=2)
+    parser.add_argument('--end', type=date.fromisoformat, default=date.today(), help='last day, YYYY-MM-DD')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    count = generate(args.output, args.years, args.accounts, args.per_day, args.categories, args.category_depth,
+                     args.end, args.seed)
+    print(f'Wrote {count} transactions over {args.years} years and {args.accounts} accounts to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+
+from src import db
+from src.app import app
+from src.cache import response_cache
+from src.loader import load_db_file
+
+
+async def client_loop(client: httpx.AsyncClient, paths: list, offset: int, deadline: float, latencies: list):
+    i = offset
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get(paths[i % len(paths)])
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        i += 1
+
+
+async def run(paths: list, clients: int, duration: float):
+    latencies = []
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench', limits=limits) as client:
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, paths, i, deadline, latencies) for i in range(clients)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'clients': clients,
+            'requests': len(latencies),
+            'rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Measures endpoint throughput with concurrent clients '
+                                                 'and the response cache disabled')
+    parser.add_argument('db_file', help='prepared DB file')
+    parser.add_argument('-p', '--path', default='/dashboard', help='endpoint taking y and m')
+    parser.add_argument('-y', '--year', type=int, default=datetime.now().year)
+    parser.add_argument('-c', '--clients', default='1,2,4,8,16')
+    parser.add_argument('-d', '--duration', type=float, default=5)
+    args = parser.parse_args()
+
+    await load_db_file(args.db_file)
+    response_cache.max_bytes = 0
+    now = datetime.now()
+    last_month = 12 if args.year < now.year else now.month
+    paths = [f'{args.path}?y={args.year}'] + [f'{args.path}?y={args.year}&m={m}' for m in range(1, last_month + 1)]
+
+    await run(paths, 1, 1)
+    for clients in map(int, args.clients.split(',')):
+        result = await run(paths, clients, args.duration)
+        print(f'{result["clients"]:>4} clients {result["rps"]:>8} req/s '
+              f'p50 {result["p50_ms"]:>8} ms p95 {result["p95_ms"]:>8} ms')
+
+    await db.engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+from src import db, repo
+
+FUNCTIONS = ('get_totals', 'get_cashflow', 'get_burn_rate')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Measures the time and the number of SQL statements per call '
+                                                 'of the aggregate repo functions')
+    parser.add_argument('db_file', help='prepared DB file')
+    parser.add_argument('-y', '--year', type=int, default=datetime.now().year)
+    parser.add_argument('-m', '--month', type=int, default=datetime.now().month)
+    parser.add_argument('-n', '--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    await db.swap_engine(args.db_file)
+    statements = [0]
+    event.listen(db.engine.sync_engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+    async with db.create_session() as session:
+        for name in FUNCTIONS:
+            function = getattr(repo, name)
+            for month in (None, args.month):
+                await function(session, args.year, month)
+                statements[0] = 0
+                started = time.perf_counter()
+                for _ in range(args.repeat):
+                    await function(session, args.year, month)
+                elapsed = (time.perf_counter() - started) / args.repeat
+                print(f'{name:<16} y={args.year} m={month or "-":<3} {elapsed * 1000:>8.2f} ms '
+                      f'{statements[0] // args.repeat} queries')
+
+    await db.engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
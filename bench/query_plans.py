@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from src import db
+from src.app import app
+from src.cache import response_cache
+from src.loader import load_db_file
+
+
+def get_endpoint_paths(year: int, month: int):
+    paths = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or 'GET' not in route.methods:
+            continue
+
+        params = {param.name for param in route.dependant.query_params}
+        if 'y' in params:
+            paths.append(f'{route.path}?y={year}')
+            paths.append(f'{route.path}?y={year}&m={month}')
+        else:
+            paths.append(route.path)
+
+    return paths
+
+
+def drop_indexes(db_file: str):
+    conn = sqlite3.connect(db_file)
+    try:
+        indexes = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL;").fetchall()
+        for (name,) in indexes:
+            conn.execute(f'DROP INDEX {name};')
+        if conn.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1';").fetchone():
+            conn.execute('DELETE FROM sqlite_stat1;')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def explain(conn: sqlite3.Connection, statement: str, parameters):
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return {'sql': ' '.join(statement.split()), 'plan': [row[-1] for row in plan]}
+
+
+async def profile(db_file: str, year: int, month: int, repeat: int):
+    await load_db_file(db_file)
+    statements = []
+
+    @event.listens_for(db.engine.sync_engine, 'before_cursor_execute')
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    results = {}
+    explain_conn = sqlite3.connect(db_file)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for path in get_endpoint_paths(year, month):
+            timings = []
+            for _ in range(repeat):
+                statements.clear()
+                response_cache.clear()
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                timings.append(time.perf_counter() - started)
+
+            results[path] = {
+                'ms': round(statistics.median(timings) * 1000, 3),
+                'queries': [explain(explain_conn, statement, parameters) for statement, parameters in statements],
+            }
+    explain_conn.close()
+
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Records query plans and timings of every endpoint '
+                                                 'with and without the indexes from sql/indexes.sql')
+    parser.add_argument('db_file', help='prepared DB file')
+    parser.add_argument('-y', '--year', type=int, default=datetime.now().year)
+    parser.add_argument('-m', '--month', type=int, default=datetime.now().month)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', default='query_plans.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        unindexed_db_file = os.path.join(tmp_dir, 'unindexed.db')
+        shutil.copyfile(args.db_file, unindexed_db_file)
+        drop_indexes(unindexed_db_file)
+        before = await profile(unindexed_db_file, args.year, args.month, args.repeat)
+    after = await profile(args.db_file, args.year, args.month, args.repeat)
+
+    report = {path: {'before': before[path], 'after': after[path]} for path in after}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for path, timings in report.items():
+        print(f'{path:<45} {timings["before"]["ms"]:>10.3f} ms {timings["after"]["ms"]:>10.3f} ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bench.generate import generate
+from bench.query_plans import get_endpoint_paths
+from src import db
+from src.app import app
+from src.cache import response_cache
+from src.loader import load_db_file
+from src.repo import prepare_data, get_preparation_phases
+
+
+async def time_preparation(source_file: str, prepared_db_file: str):
+    shutil.copyfile(source_file, prepared_db_file)
+    engine = db.create_engine(prepared_db_file)
+    try:
+        async with AsyncSession(engine) as session:
+            started = time.perf_counter()
+            await prepare_data(session)
+            elapsed = time.perf_counter() - started
+            phases = await get_preparation_phases(session)
+    finally:
+        await engine.dispose()
+
+    return {'seconds': round(elapsed, 4), 'phases': {phase: round(seconds, 4) for phase, seconds in phases}}
+
+
+async def time_endpoints(year: int, month: int, repeat: int):
+    statements = [0]
+    event.listen(db.engine.sync_engine, 'before_cursor_execute', lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench') as client:
+        for path in get_endpoint_paths(year, month):
+            await client.get(path)
+            timings = []
+            for _ in range(repeat):
+                response_cache.clear()
+                statements[0] = 0
+                started = time.perf_counter()
+                response = await client.get(path)
+                timings.append(time.perf_counter() - started)
+
+            timings.sort()
+            results[path] = {'status': response.status_code,
+                             'median_ms': round(statistics.median(timings) * 1000, 3),
+                             'p95_ms': round(timings[int(len(timings) * 0.95)] * 1000, 3),
+                             'min_ms': round(timings[0] * 1000, 3),
+                             'statements': statements[0],
+                             'bytes': len(response.content)}
+
+    return results
+
+
+def count_transactions(prepared_db_file: str):
+    conn = sqlite3.connect(prepared_db_file)
+    try:
+        return conn.execute('SELECT count(*) FROM transactions;').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def print_report(report: dict, baseline: dict):
+    def compare(current_ms, previous_ms):
+        if previous_ms is None:
+            return ''
+        return f'{previous_ms:>10.3f} ms {current_ms / previous_ms if previous_ms else 0:>6.2f}x'
+
+    def prepare_ms(prepare: dict, phase: str = None):
+        seconds = prepare.get('phases', {}).get(phase) if phase else prepare.get('seconds')
+        return seconds * 1000 if seconds is not None else None
+
+    base_prepare = baseline.get('prepare', {})
+    print(f'{"prepare_data":<45} {prepare_ms(report["prepare"]):>10.3f} ms          '
+          f'{compare(prepare_ms(report["prepare"]), prepare_ms(base_prepare))}')
+    for phase in report['prepare']['phases']:
+        print(f'  {phase:<43} {prepare_ms(report["prepare"], phase):>10.3f} ms          '
+              f'{compare(prepare_ms(report["prepare"], phase), prepare_ms(base_prepare, phase))}')
+
+    base_endpoints = baseline.get('endpoints', {})
+    for path, result in report['endpoints'].items():
+        previous = base_endpoints.get(path, {}).get('median_ms')
+        print(f'{path:<45} {result["median_ms"]:>10.3f} ms {result["statements"]:>3} queries '
+              f'{compare(result["median_ms"], previous)}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Times prepare_data, each preparation phase and every endpoint '
+                                                 'on a real or a generated backup and writes the results to JSON')
+    parser.add_argument('source', nargs='?', help='backup file, generated when omitted')
+    parser.add_argument('--years', type=int, default=1, help='years of generated data')
+    parser.add_argument('--accounts', type=int, default=10, help='generated accounts')
+    parser.add_argument('--per-day', type=int, default=8, help='generated transactions per day on average')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-y', '--year', type=int, default=datetime.now().year)
+    parser.add_argument('-m', '--month', type=int, default=datetime.now().month)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-o', '--output', default='bench.json')
+    parser.add_argument('-b', '--baseline', help='previous results to compare with')
+    args = parser.parse_args()
+
+    report = {'started_at': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_file = args.source
+        if source_file:
+            report['source'] = os.path.abspath(source_file)
+        else:
+            source_file = os.path.join(tmp_dir, 'generated.bak')
+            generate(source_file, args.years, args.accounts, args.per_day, seed=args.seed)
+            report['generated'] = {'years': args.years, 'accounts': args.accounts, 'per_day': args.per_day,
+                                   'seed': args.seed}
+
+        prepared_db_file = os.path.join(tmp_dir, 'prepared.db')
+        report['prepare'] = await time_preparation(source_file, prepared_db_file)
+        report['transactions'] = count_transactions(prepared_db_file)
+
+        await load_db_file(prepared_db_file)
+        try:
+            report['endpoints'] = await time_endpoints(args.year, args.month, args.repeat)
+        finally:
+            await db.engine.dispose()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f'{report["transactions"]} transactions, results written to {args.output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
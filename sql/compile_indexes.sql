@@ -0,0 +1,2 @@
+create index balance_history_account_timestamp
+    on balance_history (account_id, timestamp, id, balance);
\ No newline at end of file
@@ -0,0 +1,19 @@
+create index transactions_type_scheduled_timestamp
+    on transactions (type, is_scheduled, timestamp, homogenized_amount, destination_amount, destination_id);
+
+create index daily_balance_history_timestamp
+    on daily_balance_history (timestamp, balance);
+
+create index daily_account_cashflow_timestamp
+    on daily_account_cashflow (timestamp, account_id, inflow, outflow);
+
+create index daily_account_balance_timestamp_account
+    on daily_account_balance (timestamp, account_id, balance);
+
+create index daily_exchange_rates_timestamp_currency
+    on daily_exchange_rates (timestamp, currency_id, rate);
+
+create index monthly_category_rollup_year_category
+    on monthly_category_rollup (year, category_id, amount);
+
+analyze;
\ No newline at end of file
@@ -78,6 +78,51 @@ create table daily_account_cashflow
     outflow     real
 );
 
+create table daily_account_balance
+(
+    id          integer primary key,
+    timestamp   integer,
+    account_id  integer,
+    balance     real
+);
+
+create table daily_exchange_rates
+(
+    id          integer primary key,
+    timestamp   integer,
+    currency_id integer,
+    rate        real
+);
+
+
+create table monthly_rollup
+(
+    id               integer primary key,
+    year             integer,
+    month            integer,
+    income           real,
+    capped_income    real,
+    expense          real,
+    adjusted_expense real
+);
+
+
+create table monthly_category_rollup
+(
+    id          integer primary key,
+    year        integer,
+    month       integer,
+    category_id integer,
+    amount      real
+);
+
+create table preparation_phases
+(
+    id          integer primary key,
+    phase       text,
+    seconds     real
+);
+
 
 insert into currencies (id, name_short, symbol, is_default)
 values (10002, 'EUR', '€', 0),
@@ -1,25 +1,35 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 
 from .app_data import app_data
-from .db import get_db
-from .repo import prepare_data
+from .config import GZIP_MINIMUM_SIZE, GZIP_COMPRESS_LEVEL
+from .db import create_session
+from .loader import load_latest_db_file, watch_db_files
+from .middleware import ETagMiddleware, MetricsMiddleware
 from .router import router
 
 
 @asynccontextmanager
 async def lifespan(app_: FastAPI):
-    session = await get_db().__anext__()
-    await prepare_data(session)
-    await app_data.get_exchange_rates(session)
-    await session.close()
+    await load_latest_db_file()
+    async with create_session() as session:
+        await app_data.get_exchange_rates(session, fetch=False)
+    watcher = asyncio.create_task(watch_db_files())
+    rates_refresher = asyncio.create_task(app_data.refresh_exchange_rates())
     yield
+    watcher.cancel()
+    rates_refresher.cancel()
 
 
 app = FastAPI(lifespan=lifespan)
 
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(ETagMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -1,9 +1,18 @@
+import asyncio
+import csv
+import json
+import os
+from datetime import date
+
 import httpx
 from httpx import HTTPError
 from sqlalchemy import select
 
-from src.config import EXC_RATE_ENDPOINT
+from src.config import PB_EXCHANGE_ENDPOINT, EXCHANGE_RATES_PATH, EXCHANGE_RATES_FILE, EXCHANGE_RATES_TIMEOUT, \
+    EXCHANGE_RATES_REFRESH_INTERVAL
+from src.db import create_session
 from src.models import Currency
+from src.utils import get_exchange_rate_date
 
 
 example = {
@@ -25,37 +34,116 @@ FALLBACK_RATES = {'UAH': 1, 'USD': 41.2, 'EUR': 45.5}
 class AppData:
     def __init__(self):
         self.exchange_rates = {}
+        self.exchange_rates_date = None
 
-    async def get_exchange_rates(self, session):
-        if self.exchange_rates:
-            return self.exchange_rates
-
+    async def get_exchange_rates(self, session, fetch=True):
+        rates_date = get_exchange_rate_date()
         q = select(Currency)
         result = await session.execute(q)
         currencies = result.scalars().all()
-        try:
-            api_response = httpx.get(EXC_RATE_ENDPOINT)
-            api_response.raise_for_status()
-            res = api_response.json()
-            rates_dict = {}
 
-            for curr in currencies:
-                if curr.is_default:
-                    rates_dict[curr.name_short] = 1
-                else:
-                    rates_dict[curr.name_short] = \
-                        [pair for pair in res['exchangeRate'] if pair['currency'] == curr.name_short][0]['saleRateNB']
-        except (HTTPError, IndexError):
-            rates_dict = FALLBACK_RATES
+        rates_dict = read_cached_rates(rates_date)
+        if rates_dict is None and fetch:
+            rates_dict = await fetch_rates(rates_date, currencies)
+            if rates_dict is not None:
+                write_cached_rates(rates_date, rates_dict)
+
+        if rates_dict is None:
+            if self.exchange_rates:
+                return self.exchange_rates
+            rates_date = None
+            rates_dict = read_latest_cached_rates() or FALLBACK_RATES
 
         exchange_rates_matrix = {}
         for curr1 in currencies:
+            if curr1.name_short not in rates_dict:
+                continue
             exchange_rates_matrix[curr1.name_short] = {}
             for curr2 in currencies:
+                if curr2.name_short not in rates_dict:
+                    continue
                 exchange_rates_matrix[curr1.name_short][curr2.name_short] = (
                         rates_dict[curr1.name_short] / rates_dict[curr2.name_short])
 
         self.exchange_rates = exchange_rates_matrix
+        self.exchange_rates_date = rates_date
         return exchange_rates_matrix
 
+    async def refresh_exchange_rates(self):
+        while True:
+            if self.exchange_rates_date != get_exchange_rate_date():
+                try:
+                    async with create_session() as session:
+                        await self.get_exchange_rates(session)
+                except Exception as e:
+                    print(f'Failed to refresh exchange rates: {e}')
+            await asyncio.sleep(EXCHANGE_RATES_REFRESH_INTERVAL)
+
+
+async def fetch_rates(rates_date: date, currencies):
+    try:
+        async with httpx.AsyncClient(timeout=EXCHANGE_RATES_TIMEOUT) as client:
+            api_response = await client.get(PB_EXCHANGE_ENDPOINT.format(rates_date.strftime('%d.%m.%Y')))
+            api_response.raise_for_status()
+            res = api_response.json()
+
+        rates_dict = {}
+        for curr in currencies:
+            if curr.is_default:
+                rates_dict[curr.name_short] = 1
+            else:
+                rates_dict[curr.name_short] = \
+                    [pair for pair in res['exchangeRate'] if pair['currency'] == curr.name_short][0]['saleRateNB']
+        return rates_dict
+    except (HTTPError, IndexError, KeyError, ValueError) as e:
+        print(f'Failed to fetch exchange rates for {rates_date}: {e!r}')
+        return None
+
+
+def get_cached_rates_file(rates_date: date):
+    return os.path.join(EXCHANGE_RATES_PATH, f'{rates_date.isoformat()}.json')
+
+
+def read_cached_rates(rates_date: date):
+    try:
+        with open(get_cached_rates_file(rates_date)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_latest_cached_rates():
+    if not os.path.isdir(EXCHANGE_RATES_PATH):
+        return None
+
+    cached_files = sorted(f.name for f in os.scandir(EXCHANGE_RATES_PATH) if f.name.endswith('.json'))
+    return read_cached_rates(date.fromisoformat(cached_files[-1][:-5])) if cached_files else None
+
+
+def read_rates_history():
+    history = []
+    if os.path.isfile(EXCHANGE_RATES_FILE):
+        with open(EXCHANGE_RATES_FILE, newline='') as f:
+            for row in csv.DictReader(f):
+                history.append((date.fromisoformat(row['date']), row['currency'], float(row['rate'])))
+
+    if os.path.isdir(EXCHANGE_RATES_PATH):
+        for f in os.scandir(EXCHANGE_RATES_PATH):
+            if f.name.endswith('.json'):
+                rates_date = date.fromisoformat(f.name[:-5])
+                rates_dict = read_cached_rates(rates_date) or {}
+                history.extend((rates_date, currency, rate) for currency, rate in rates_dict.items())
+
+    return sorted(history)
+
+
+def write_cached_rates(rates_date: date, rates_dict: dict):
+    os.makedirs(EXCHANGE_RATES_PATH, exist_ok=True)
+    cached_rates_file = get_cached_rates_file(rates_date)
+    tmp_file = f'{cached_rates_file}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(rates_dict, f)
+    os.replace(tmp_file, cached_rates_file)
+
+
 app_data = AppData()
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from typing import Optional
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+from sqlalchemy import Row
+
+from .config import RESPONSE_CACHE_MAX_BYTES
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.responses = OrderedDict()
+        self.bytes = 0
+        self.generation = 0
+        self.date = date.today()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.date != date.today():
+            self.clear()
+
+        body = self.responses.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+
+        self.responses.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def set(self, key, body: bytes, generation: int):
+        if generation != self.generation or len(body) > self.max_bytes:
+            return
+
+        previous = self.responses.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous)
+        self.responses[key] = body
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, evicted = self.responses.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def clear(self):
+        self.responses.clear()
+        self.bytes = 0
+        self.generation += 1
+        self.date = date.today()
+
+    @property
+    def stats(self):
+        return {'size': len(self.responses),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_BYTES)
+
+
+def json_default(obj):
+    if isinstance(obj, Row):
+        return obj._asdict()
+    raise TypeError
+
+
+def to_json(content) -> bytes:
+    return orjson.dumps(content, default=json_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in tags
+
+
+def etag_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={**headers, 'Vary': 'Accept-Encoding'})
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def cached(endpoint):
+    @wraps(endpoint)
+    async def wrapper(**kwargs):
+        key = (endpoint.__name__, tuple((name, value) for name, value in kwargs.items() if name != 'db'))
+        body = response_cache.get(key)
+        if body is None:
+            generation = response_cache.generation
+            result = await endpoint(**kwargs)
+            body = to_json(result)
+            response_cache.set(key, body, generation)
+
+        return Response(body, media_type='application/json')
+
+    return wrapper
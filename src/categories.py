@@ -0,0 +1,57 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .dataclasses import Category
+from .models import CategoryModel, CategoryType
+
+
+class CategoryTree:
+    def __init__(self):
+        self.categories = {}
+        self.expense_ids = frozenset()
+        self.ancestors = {}
+        self.descendants = {}
+
+    async def load(self, db: AsyncSession):
+        q = select(CategoryModel.id, CategoryModel.type, CategoryModel.name, CategoryModel.color,
+                   CategoryModel.parent_category_id)
+        res = await db.execute(q)
+        rows = res.all()
+
+        categories = {row.id: Category(row.id, row.name, row.color, row.parent_category_id) for row in rows}
+        for cat in categories.values():
+            cat.parent_category = categories.get(cat.parent_category_id)
+
+        ancestors = {}
+        descendants = {cat_id: {cat_id} for cat_id in categories}
+        for cat in categories.values():
+            path = [cat.id]
+            parent = cat.parent_category
+            while parent and parent.id not in path:
+                descendants[parent.id].add(cat.id)
+                path.append(parent.id)
+                parent = parent.parent_category
+            ancestors[cat.id] = tuple(reversed(path))
+
+        self.categories = categories
+        self.expense_ids = frozenset(row.id for row in rows if row.type == CategoryType.EXPENSE)
+        self.ancestors = ancestors
+        self.descendants = {cat_id: frozenset(ids) for cat_id, ids in descendants.items()}
+        print(f'Loaded {len(categories)} categories, {max(map(len, ancestors.values()), default=0)} levels deep')
+
+    def replace(self, other: 'CategoryTree'):
+        vars(self).update(vars(other))
+
+    def ancestor(self, category_id: int, depth: int = 0):
+        path = self.ancestors.get(category_id, (category_id,))
+        return path[min(depth, len(path) - 1)]
+
+    def subtree(self, category_id: int):
+        return self.descendants.get(category_id, frozenset((category_id,)))
+
+
+category_tree = CategoryTree()
+
+
+def get_category_tree(db: AsyncSession) -> CategoryTree:
+    return db.info.get('category_tree') or category_tree
@@ -0,0 +1,39 @@
+import argparse
+import asyncio
+
+import uvicorn
+
+from .config import SERVE_HOST, SERVE_PORT, SERVE_WORKERS
+from .loader import prepare_db_file
+from .utils import get_latest_db_file
+
+
+def prepare(db_file: str = None):
+    prepared_db_file = asyncio.run(prepare_db_file(db_file or get_latest_db_file()))
+    print(f'Prepared {prepared_db_file}')
+
+
+def serve(host: str, port: int, workers: int):
+    prepare()
+    uvicorn.run('src.app:app', host=host, port=port, workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m src.cli')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    prepare_parser = subparsers.add_parser('prepare', help='translate and compile the latest backup, then exit')
+    prepare_parser.add_argument('db_file', nargs='?', help='backup to prepare instead of the latest one')
+    serve_parser = subparsers.add_parser('serve', help='prepare the latest backup once, then start the workers')
+    serve_parser.add_argument('--host', default=SERVE_HOST)
+    serve_parser.add_argument('--port', type=int, default=SERVE_PORT)
+    serve_parser.add_argument('-w', '--workers', type=int, default=SERVE_WORKERS)
+    args = parser.parse_args()
+
+    if args.command == 'prepare':
+        prepare(args.db_file)
+    else:
+        serve(args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select, func, Integer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import BURN_RATE_AMOUNT_THRESHOLD, MAX_TRANSACTION_AMOUNT_THRESHOLD
+from .categories import get_category_tree
+from .models import TransactionModel, TransactionType
+from .repo import build_cashflow, build_burn_rate, build_subcategory_amounts, build_category_amounts
+from .utils import timeframe_to_timestamps
+
+
+class ColumnarStore:
+    def __init__(self):
+        self.timestamp = np.empty(0, dtype=np.int64)
+        self.type = np.empty(0, dtype=np.int8)
+        self.account_id = np.empty(0, dtype=np.int64)
+        self.destination_id = np.empty(0, dtype=np.int64)
+        self.amount = np.empty(0, dtype=np.float64)
+        self.destination_amount = np.empty(0, dtype=np.float64)
+        self.homogenized_amount = np.empty(0, dtype=np.float64)
+        self.is_scheduled = np.empty(0, dtype=bool)
+        self.month = np.empty(0, dtype=np.int8)
+        self.day = np.empty(0, dtype=np.int8)
+
+    async def load(self, db: AsyncSession):
+        q = (
+            select(TransactionModel.timestamp,
+                   TransactionModel.type,
+                   TransactionModel.account_id,
+                   func.coalesce(TransactionModel.destination_id, 0),
+                   TransactionModel.amount,
+                   TransactionModel.destination_amount,
+                   TransactionModel.homogenized_amount,
+                   TransactionModel.is_scheduled,
+                   func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer),
+                   func.cast(func.strftime('%d', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer))
+            .order_by(TransactionModel.timestamp)
+        )
+        res = await db.execute(q)
+        columns = list(zip(*res.all())) or [()] * 10
+
+        self.timestamp = np.array(columns[0], dtype=np.int64)
+        self.type = np.array(columns[1], dtype=np.int8)
+        self.account_id = np.array(columns[2], dtype=np.int64)
+        self.destination_id = np.array(columns[3], dtype=np.int64)
+        self.amount = np.array(columns[4], dtype=np.float64)
+        self.destination_amount = np.array(columns[5], dtype=np.float64)
+        self.homogenized_amount = np.array(columns[6], dtype=np.float64)
+        self.is_scheduled = np.array(columns[7], dtype=bool)
+        self.month = np.array(columns[8], dtype=np.int8)
+        self.day = np.array(columns[9], dtype=np.int8)
+        print(f'Loaded {len(self.timestamp)} transactions into the columnar store')
+
+    def replace(self, other: 'ColumnarStore'):
+        vars(self).update(vars(other))
+
+    def select(self, year: int, month: Optional[int], transaction_type: int, amount_field: str,
+               threshold: Optional[float] = MAX_TRANSACTION_AMOUNT_THRESHOLD):
+        lo, hi = np.searchsorted(self.timestamp, timeframe_to_timestamps(year, month))
+        amounts = getattr(self, amount_field)[lo:hi]
+        mask = (self.type[lo:hi] == transaction_type) & ~self.is_scheduled[lo:hi]
+        mask &= amounts < threshold if threshold else ~np.isnan(amounts)
+        index = lo + np.flatnonzero(mask)
+        return index, amounts[mask]
+
+
+columnar_store = ColumnarStore()
+
+
+def get_columnar_store(db: AsyncSession) -> ColumnarStore:
+    return db.info.get('columnar_store') or columnar_store
+
+
+def sum_or_none(amounts):
+    return float(amounts.sum()) if len(amounts) else None
+
+
+def group_sums(keys, amounts, key_to_row):
+    sums = np.bincount(keys, weights=amounts, minlength=32)
+    counts = np.bincount(keys, minlength=32)
+    return [key_to_row(int(key), float(sums[key])) for key in np.flatnonzero(counts)]
+
+
+async def get_totals(db: AsyncSession, year: int, month: Optional[int]):
+    store = get_columnar_store(db)
+    _, expenses = store.select(year, month, TransactionType.EXPENSE, 'homogenized_amount')
+    _, incomes = store.select(year, month, TransactionType.INCOME, 'destination_amount', None)
+    return {'sum_income': sum_or_none(incomes), 'sum_expenses': sum_or_none(expenses)}
+
+
+async def get_cashflow(db: AsyncSession, year: int, month: Optional[int]):
+    store = get_columnar_store(db)
+
+    def get_rows(transaction_type, amount_field):
+        index, amounts = store.select(year, month, transaction_type, amount_field)
+        return group_sums(store.month[index], amounts, lambda m, total: (year, m, total))
+
+    result_income = get_rows(TransactionType.INCOME, 'destination_amount')
+    result_expense = get_rows(TransactionType.EXPENSE, 'homogenized_amount')
+    return build_cashflow(result_expense, result_income)
+
+
+async def get_burn_rate(db: AsyncSession, year: int, month: Optional[int]):
+    store = get_columnar_store(db)
+    index, amounts = store.select(year, month, TransactionType.EXPENSE, 'homogenized_amount')
+    if month:
+        keys = store.day[index]
+        key_to_row = lambda d, total: (year, month, d, total)
+    else:
+        keys = store.month[index]
+        key_to_row = lambda m, total: (year, m, 1, total)
+
+    result_raw = group_sums(keys, amounts, key_to_row)
+    if not result_raw:
+        return {}
+
+    adjusted = np.abs(amounts) < BURN_RATE_AMOUNT_THRESHOLD
+    result_adjusted = group_sums(keys[adjusted], amounts[adjusted], key_to_row)
+    return build_burn_rate(year, month, result_raw, result_adjusted)
+
+
+async def get_subcategory_amounts(db: AsyncSession, year: int, month: Optional[int]):
+    store = get_columnar_store(db)
+    tree = get_category_tree(db)
+    index, amounts = store.select(year, month, TransactionType.EXPENSE, 'homogenized_amount')
+    category_ids, inverse = np.unique(store.destination_id[index], return_inverse=True)
+    sums = np.bincount(inverse, weights=amounts, minlength=len(category_ids))
+
+    amounts_by_name = {}
+    for category_id, total in zip(category_ids.tolist(), sums.tolist()):
+        if category_id not in tree.expense_ids:
+            continue
+        category = tree.categories[category_id]
+        if category.name in amounts_by_name:
+            amounts_by_name[category.name][-1] += total
+        else:
+            amounts_by_name[category.name] = [category.id, category.name, category.color, category.parent_category_id,
+                                              total]
+
+    return build_subcategory_amounts(amounts_by_name.values())
+
+
+async def get_category_amounts(db: AsyncSession, year: int, month: Optional[int], depth: int = 0):
+    subc_amounts = await get_subcategory_amounts(db, year, month)
+    return build_category_amounts(subc_amounts, get_category_tree(db), depth)
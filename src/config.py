@@ -1,9 +1,34 @@
-from datetime import datetime, timedelta
-
 BURN_RATE_AMOUNT_THRESHOLD = 4000
 MAX_TRANSACTION_AMOUNT_THRESHOLD = 1_000_000
 DATA_PATH = '/app/data'
+PREPARED_DATA_PATH = f'{DATA_PATH}/.prepared'
+PREPARATION_LOCK_FILE = f'{PREPARED_DATA_PATH}/.lock'
 PREPARATORY_QUERIES_FILE = 'sql/preparatory_queries.sql'
-EXCHANGE_RATE_DATE = datetime.now() if datetime.now().hour > 8 else datetime.now() - timedelta(days=1)
+COMPILE_INDEX_QUERIES_FILE = 'sql/compile_indexes.sql'
+INDEX_QUERIES_FILE = 'sql/indexes.sql'
+PREPARATION_MODULES = ('repo.py', 'models.py', 'app_data.py')
+PREPARED_DB_VERSION = 99
+INCREMENTAL_IMPORT = True
+PREPARED_DB_GRACE_PERIOD = 3600  # seconds a superseded prepared DB is kept for workers still serving it
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # total size of the cached response bodies
+ETAG_EXCLUDED_PATHS = ('/exchange_rates', '/cache_stats', '/metrics')
+GZIP_MINIMUM_SIZE = 1024
+GZIP_COMPRESS_LEVEL = 6
+SERVE_HOST = '0.0.0.0'
+SERVE_PORT = 8000
+SERVE_WORKERS = 1
+DB_POOL_SIZE = 8
+DB_POOL_MAX_OVERFLOW = 8
+DB_CACHE_SIZE_KIB = 16384
+DB_MMAP_SIZE = 1024 * 1024 * 1024
+TRANSACTIONS_PAGE_MAX_SIZE = 1000
+TRANSACTIONS_STREAM_BATCH_SIZE = 500
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+METRICS_STATEMENT_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+SLOW_QUERY_THRESHOLD = None  # seconds, logs slower statements with their query plans
+DATA_BACKEND = 'sql'  # 'sql' or 'columnar' (requires numpy)
+EXCHANGE_RATES_PATH = f'{DATA_PATH}/.exchange_rates'
+EXCHANGE_RATES_FILE = f'{DATA_PATH}/exchange_rates.csv'
+EXCHANGE_RATES_TIMEOUT = 10
+EXCHANGE_RATES_REFRESH_INTERVAL = 3600
 PB_EXCHANGE_ENDPOINT = 'https://api.privatbank.ua/p24api/exchange_rates?json&date={}'
-EXC_RATE_ENDPOINT = PB_EXCHANGE_ENDPOINT.format(EXCHANGE_RATE_DATE.strftime('%d.%m.%Y'))
@@ -1,17 +1,63 @@
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from .utils import get_latest_db_file
+from .config import DB_POOL_SIZE, DB_POOL_MAX_OVERFLOW, DB_CACHE_SIZE_KIB, DB_MMAP_SIZE
+from .metrics import instrument_engine
 
-DATABASE_URL = f'sqlite+aiosqlite:///{get_latest_db_file()}'
-
-engine = create_async_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
+db_file = None
+engine = None
+SessionLocal = None
 
 Base = declarative_base()
 
 
+def create_engine(file: str):
+    return create_async_engine(f'sqlite+aiosqlite:///{file}', connect_args={"check_same_thread": False})
+
+
+def create_read_only_engine(file: str):
+    read_only_engine = create_async_engine(f'sqlite+aiosqlite:///file:{file}?mode=ro&immutable=1&uri=true',
+                                           connect_args={"check_same_thread": False},
+                                           poolclass=AsyncAdaptedQueuePool,
+                                           pool_size=DB_POOL_SIZE,
+                                           max_overflow=DB_POOL_MAX_OVERFLOW)
+
+    @event.listens_for(read_only_engine.sync_engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA query_only = ON')
+        cursor.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KIB}')
+        cursor.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        cursor.close()
+
+    instrument_engine(read_only_engine)
+    return read_only_engine
+
+
+async def swap_engine(new_db_file: str):
+    old_engine = publish_engine(new_db_file, create_read_only_engine(new_db_file))
+    if old_engine:
+        await old_engine.dispose()
+
+
+def publish_engine(new_db_file: str, new_engine, snapshot: dict = None):
+    global db_file, engine, SessionLocal
+    old_engine = engine
+
+    db_file = new_db_file
+    engine = new_engine
+    # every session carries the data loaded from its own DB, so a request never mixes two DBs across awaits
+    SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine, info=snapshot)
+    return old_engine
+
+
+def create_session():
+    return SessionLocal()
+
+
 async def get_db():
-    db = SessionLocal()
-    yield db
+    async with SessionLocal() as db:
+        yield db
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import shutil
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from watchfiles import awatch
+
+from . import db
+from .cache import response_cache
+from .categories import CategoryTree, category_tree
+from .config import DATA_PATH, PREPARED_DATA_PATH, PREPARATION_LOCK_FILE, INCREMENTAL_IMPORT, DATA_BACKEND, \
+    PREPARED_DB_GRACE_PERIOD, EXCHANGE_RATES_FILE, EXCHANGE_RATES_PATH
+from .reference import ReferenceData, reference_data
+from .metrics import metrics
+from .repo import prepare_data, get_preparation_phases
+from .utils import get_latest_db_file, get_latest_prepared_db_file, get_file_hash, get_preparation_version, \
+    get_rates_version
+
+if DATA_BACKEND == 'columnar':
+    from .columnar import ColumnarStore, columnar_store
+
+
+async def get_prepared_db_file(db_file: str):
+    source_hash = await asyncio.to_thread(get_file_hash, db_file)
+    return os.path.join(PREPARED_DATA_PATH,
+                        f'{source_hash[:16]}-{get_preparation_version()}-{get_rates_version()}.db')
+
+
+@asynccontextmanager
+async def preparation_lock():
+    os.makedirs(PREPARED_DATA_PATH, exist_ok=True)
+    with open(PREPARATION_LOCK_FILE, 'w') as lock_file:
+        if fcntl:
+            await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        yield
+
+
+async def prepare_db_file(db_file: str):
+    prepared_db_file = await get_prepared_db_file(db_file)
+    if os.path.exists(prepared_db_file):
+        return prepared_db_file
+
+    async with preparation_lock():
+        if not os.path.exists(prepared_db_file):
+            previous_db_file = get_latest_prepared_db_file() if INCREMENTAL_IMPORT else None
+            await translate_db_file(db_file, prepared_db_file, previous_db_file)
+            remove_stale_db_files(prepared_db_file, previous_db_file, db.db_file)
+    return prepared_db_file
+
+
+async def translate_db_file(db_file: str, prepared_db_file: str, previous_db_file: Optional[str] = None):
+    print(f'Preparing {db_file}')
+    tmp_db_file = f'{prepared_db_file}.{os.getpid()}.tmp'
+    try:
+        await asyncio.to_thread(shutil.copyfile, db_file, tmp_db_file)
+        engine = db.create_engine(tmp_db_file)
+        try:
+            async with AsyncSession(engine) as session:
+                await prepare_data(session, previous_db_file)
+        finally:
+            await engine.dispose()
+        os.replace(tmp_db_file, prepared_db_file)
+    finally:
+        if os.path.exists(tmp_db_file):
+            os.remove(tmp_db_file)
+
+
+def remove_stale_db_files(*kept_db_files: Optional[str]):
+    # runs in the preparation lock holder only, so leftover tmp files belong to crashed preparations. Other
+    # workers keep serving older DBs until their watchers swap, so those go only after the grace period
+    stale_files = [f.path for f in os.scandir(PREPARED_DATA_PATH) if f.path.endswith('.tmp')]
+    db_files = sorted((f for f in os.scandir(PREPARED_DATA_PATH) if f.path.endswith('.db')),
+                      key=lambda f: f.stat().st_mtime)
+    for f, newer in zip(db_files, db_files[1:]):
+        if f.path not in kept_db_files and time.time() - newer.stat().st_mtime > PREPARED_DB_GRACE_PERIOD:
+            stale_files.append(f.path)
+
+    for path in stale_files:
+        try:
+            os.remove(path)
+            print(f'Removed {path}')
+        except OSError as e:
+            print(f'Failed to remove {path}: {e}')
+
+
+async def prepare_db_file_in_subprocess(db_file: str):
+    # the compile steps are CPU bound, so they run in their own process to keep the serving loop responsive
+    process = await asyncio.create_subprocess_exec(sys.executable, '-m', 'src.cli', 'prepare', db_file)
+    try:
+        return_code = await process.wait()
+    except asyncio.CancelledError:
+        process.kill()
+        raise
+    if return_code != 0:
+        raise RuntimeError(f'Preparing {db_file} failed with exit code {return_code}')
+
+
+async def load_latest_db_file():
+    db_file = get_latest_db_file()
+    prepared_db_file = await get_prepared_db_file(db_file)
+    if not os.path.exists(prepared_db_file):
+        await prepare_db_file_in_subprocess(db_file)
+        # the exchange rates may have been refreshed in the meantime
+        prepared_db_file = await get_prepared_db_file(db_file)
+    if prepared_db_file != db.db_file:
+        print(f'Serving {prepared_db_file}')
+        await load_db_file(prepared_db_file)
+
+
+async def load_db_file(prepared_db_file: str):
+    engine = db.create_read_only_engine(prepared_db_file)
+    new_category_tree = CategoryTree()
+    new_reference_data = ReferenceData()
+    new_columnar_store = ColumnarStore() if DATA_BACKEND == 'columnar' else None
+    try:
+        async with AsyncSession(engine) as session:
+            await new_category_tree.load(session)
+            await new_reference_data.load(session, prepared_db_file)
+            phases = await get_preparation_phases(session)
+            if new_columnar_store:
+                await new_columnar_store.load(session)
+    except BaseException:
+        await engine.dispose()
+        raise
+
+    # no awaits until everything is published, so requests see either the old or the new data, never a mix
+    old_engine = db.publish_engine(prepared_db_file, engine, {'category_tree': new_category_tree,
+                                                              'reference_data': new_reference_data,
+                                                              'columnar_store': new_columnar_store})
+    category_tree.replace(new_category_tree)
+    reference_data.replace(new_reference_data)
+    if new_columnar_store:
+        columnar_store.replace(new_columnar_store)
+    metrics.set_preparation_phases(phases)
+    response_cache.clear()
+
+    if old_engine:
+        await old_engine.dispose()
+
+
+def is_preparation_input(change, path: str):
+    return (path.endswith('.bak') or path == EXCHANGE_RATES_FILE
+            or (os.path.dirname(path) == EXCHANGE_RATES_PATH and path.endswith('.json')))
+
+
+async def watch_db_files():
+    async for _ in awatch(DATA_PATH, watch_filter=is_preparation_input):
+        try:
+            await load_latest_db_file()
+        except Exception as e:
+            print(f'Failed to load the latest DB: {e}')
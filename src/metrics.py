@@ -0,0 +1,141 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .config import METRICS_LATENCY_BUCKETS, METRICS_STATEMENT_BUCKETS, SLOW_QUERY_THRESHOLD
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            labels = format_labels(self.labels, label_values)
+            count = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), series):
+                count += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labels: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        for label_values, value in self.values.items():
+            lines.append(f'{self.name}{{{format_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+
+class QueryStats:
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.request_seconds = Histogram('http_request_duration_seconds', 'Time spent handling requests',
+                                         METRICS_LATENCY_BUCKETS, ('method', 'endpoint', 'status'))
+        self.db_statements = Histogram('db_statements_per_request', 'SQL statements executed per request',
+                                       METRICS_STATEMENT_BUCKETS, ('endpoint',))
+        self.db_seconds = Histogram('db_seconds_per_request', 'Time spent in SQLite per request',
+                                    METRICS_LATENCY_BUCKETS, ('endpoint',))
+        self.preparation_seconds = Gauge('preparation_phase_seconds',
+                                         'Time spent in each phase of preparing the served DB', ('phase',))
+
+    def observe_request(self, method: str, endpoint: str, status: int, seconds: float, stats: QueryStats):
+        self.request_seconds.observe(seconds, method, endpoint, status)
+        self.db_statements.observe(stats.statements, endpoint)
+        self.db_seconds.observe(stats.seconds, endpoint)
+
+    def set_preparation_phases(self, phases):
+        self.preparation_seconds.values.clear()
+        for phase, seconds in phases:
+            self.preparation_seconds.set(seconds, phase)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.request_seconds, self.db_statements, self.db_seconds, self.preparation_seconds):
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+query_stats: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+@contextmanager
+def preparation_phase(phases: dict, phase: str):
+    print(f'Running {phase}')
+    started = time.perf_counter()
+    yield
+    phases[phase] = time.perf_counter() - started
+
+
+def instrument_engine(engine: AsyncEngine):
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += elapsed
+
+    if SLOW_QUERY_THRESHOLD is not None and elapsed >= SLOW_QUERY_THRESHOLD and not executemany:
+        log_slow_query(conn, statement, parameters, elapsed)
+
+
+def log_slow_query(conn, statement: str, parameters, elapsed: float):
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters)
+        plan = '\n'.join(f'  {row[-1]}' for row in cursor.fetchall())
+    except Exception as e:
+        plan = f'  no query plan: {e}'
+    finally:
+        cursor.close()
+    print(f'Slow query ({elapsed * 1000:.1f} ms): {" ".join(statement.split())} {parameters}\n{plan}')
@@ -0,0 +1,81 @@
+import hashlib
+import time
+from datetime import date
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from .cache import etag_matches
+from .config import ETAG_EXCLUDED_PATHS
+from .metrics import metrics, query_stats, QueryStats
+from .reference import reference_data
+from .utils import get_code_version
+
+
+class ETagMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.code_version = get_code_version()
+
+    def etag(self, scope: Scope):
+        # the tag covers the path and the query, so only a URL that was validated and answered with it can get a 304;
+        # weak, since GZipMiddleware serves the same tag both compressed and not
+        query = urlencode(sorted(parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)))
+        url_hash = hashlib.sha256(f'{scope["path"]}?{query}'.encode()).hexdigest()[:16]
+        return f'W/"{reference_data.version}-{self.code_version}-{date.today():%Y%m%d}-{url_hash}"'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD') or reference_data.version is None
+                or scope['path'] in ETAG_EXCLUDED_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        etag = self.etag(scope)
+        if etag_matches(Headers(scope=scope).get('if-none-match'), etag):
+            response = Response(status_code=304, headers={'ETag': etag, 'Cache-Control': 'no-cache',
+                                                          'Vary': 'Accept-Encoding'})
+            await response(scope, receive, send)
+            return
+
+        async def send_with_etag(message: Message):
+            if message['type'] == 'http.response.start' and message['status'] == 200:
+                headers = MutableHeaders(scope=message)
+                if 'etag' not in headers:
+                    headers['ETag'] = etag
+                    headers['Cache-Control'] = 'no-cache'
+                if 'accept-encoding' not in headers.get('vary', '').lower():
+                    headers.add_vary_header('Accept-Encoding')
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            query_stats.reset(token)
+            route = scope.get('route')
+            endpoint = route.path if route else 'unmatched' if status == 404 else scope['path']
+            metrics.observe_request(scope['method'], endpoint, status, time.perf_counter() - started, stats)
@@ -110,3 +110,46 @@ class DailyAccountCashflowModel(Base):
     account_id = Column(Integer)
     inflow = Column(Float)
     outflow = Column(Float)
+
+
+class DailyAccountBalanceModel(Base):
+    __tablename__ = 'daily_account_balance'
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(Integer)
+    account_id = Column(Integer)
+    balance = Column(Float)
+
+
+class DailyExchangeRateModel(Base):
+    __tablename__ = 'daily_exchange_rates'
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(Integer)
+    currency_id = Column(Integer)
+    rate = Column(Float)
+
+
+class MonthlyRollupModel(Base):
+    __tablename__ = 'monthly_rollup'
+    id = Column(Integer, primary_key=True)
+    year = Column(Integer)
+    month = Column(Integer)
+    income = Column(Float)
+    capped_income = Column(Float)
+    expense = Column(Float)
+    adjusted_expense = Column(Float)
+
+
+class MonthlyCategoryRollupModel(Base):
+    __tablename__ = 'monthly_category_rollup'
+    id = Column(Integer, primary_key=True)
+    year = Column(Integer)
+    month = Column(Integer)
+    category_id = Column(Integer, ForeignKey('categories.id'))
+    amount = Column(Float)
+
+
+class PreparationPhaseModel(Base):
+    __tablename__ = 'preparation_phases'
+    id = Column(Integer, primary_key=True)
+    phase = Column(String)
+    seconds = Column(Float)
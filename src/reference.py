@@ -0,0 +1,53 @@
+import hashlib
+import os
+from types import MappingProxyType
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import to_json
+from .dataclasses import Account
+from .models import AccountModel, Currency, CategoryModel
+
+
+class ReferenceData:
+    def __init__(self):
+        self.version = None
+        self.accounts = MappingProxyType({})
+        self.currency_codes = frozenset()
+        self.bodies = MappingProxyType({})
+        self.etags = MappingProxyType({})
+
+    async def load(self, db: AsyncSession, db_file: str):
+        res = await db.execute(select(*AccountModel.__table__.columns).order_by(AccountModel.show_order))
+        accounts = res.all()
+        res = await db.execute(select(*Currency.__table__.columns))
+        currencies = res.all()
+        res = await db.execute(select(*CategoryModel.__table__.columns))
+        categories = res.all()
+
+        currencies_dict = {curr.id: curr for curr in currencies}
+        bodies = {
+            'accounts': to_json([{**acc._asdict(), 'currency': currencies_dict.get(acc.currency_id)}
+                                 for acc in accounts if acc.is_archived is False]),
+            'currencies': to_json(currencies),
+            'categories': to_json(categories),
+        }
+
+        self.version = os.path.splitext(os.path.basename(db_file))[0]
+        self.accounts = MappingProxyType({acc.id: Account(acc.id, acc.name) for acc in accounts})
+        self.currency_codes = frozenset(curr.name_short for curr in currencies)
+        self.bodies = MappingProxyType(bodies)
+        self.etags = MappingProxyType({name: f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+                                       for name, body in bodies.items()})
+        print(f'Loaded reference data {self.version}')
+
+    def replace(self, other: 'ReferenceData'):
+        vars(self).update(vars(other))
+
+
+reference_data = ReferenceData()
+
+
+def get_reference_data(db: AsyncSession) -> ReferenceData:
+    return db.info.get('reference_data') or reference_data
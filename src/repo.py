@@ -1,107 +1,117 @@
+import heapq
+from bisect import bisect_right
 from calendar import monthrange
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Optional
 
-from sqlalchemy import select, func, Integer, text
+from sqlalchemy import select, func, Integer, text, insert, case, and_, literal, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
-
-from .config import PREPARATORY_QUERIES_FILE, MAX_TRANSACTION_AMOUNT_THRESHOLD, BURN_RATE_AMOUNT_THRESHOLD
-from .dataclasses import CashFlowMonth, TF, BurnRateDay, BurnRateMonth, CategoryAmount, Category, Account, Transaction
+from sqlalchemy.orm import aliased
+
+from .app_data import FALLBACK_RATES, read_rates_history
+from .categories import CategoryTree, get_category_tree
+from .metrics import preparation_phase
+from .reference import get_reference_data
+from .config import PREPARATORY_QUERIES_FILE, MAX_TRANSACTION_AMOUNT_THRESHOLD, BURN_RATE_AMOUNT_THRESHOLD, \
+    PREPARED_DB_VERSION, COMPILE_INDEX_QUERIES_FILE, INDEX_QUERIES_FILE, TRANSACTIONS_STREAM_BATCH_SIZE
+from .dataclasses import CashFlowMonth, TF, BurnRateDay, BurnRateMonth, CategoryAmount, Category, Transaction
 from .models import AccountModel, Currency, CategoryModel, TransactionModel, TransactionType, CategoryType, \
-    BalanceHistoryModel, DailyBalanceHistoryModel, DailyAccountCashflowModel
-from .utils import timeframe_to_timestamps, savings_separators
+    BalanceHistoryModel, DailyBalanceHistoryModel, DailyAccountCashflowModel, MonthlyRollupModel, \
+    MonthlyCategoryRollupModel, DailyAccountBalanceModel, DailyExchangeRateModel, PreparationPhaseModel
+from .utils import timeframe_to_timestamps, savings_separators, savings_range_separators, day_start, \
+    encode_cursor, decode_cursor
 
 
 async def get_accounts(db: AsyncSession, with_archived=False, currency_id=None):
-    q = select(AccountModel).order_by(AccountModel.show_order)
+    q = select(*AccountModel.__table__.columns).order_by(AccountModel.show_order)
     if not with_archived:
         q = q.where(AccountModel.is_archived.is_(with_archived))
     if currency_id:
         q = q.where(AccountModel.currency_id == currency_id)
     res = await db.execute(q)
-    r = res.scalars().all()
-    return r
-
-
-async def get_accounts_dict(db: AsyncSession):
-    res = await get_accounts(db, with_archived=True)
-    accounts = {acc.id: Account(acc.id, acc.name) for acc in res}
-    return accounts
+    return res.all()
 
 
-async def get_currencies(db: AsyncSession):
-    q = select(Currency)
-    res = await db.execute(q)
-    return res.scalars().all()
-
+def income_amount(capped: bool = False):
+    condition = TransactionModel.type == TransactionType.INCOME
+    if capped:
+        condition = and_(condition, TransactionModel.destination_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
+    return case((condition, TransactionModel.destination_amount))
 
-async def get_categories(db: AsyncSession):
-    q = select(CategoryModel)
-    res = await db.execute(q)
-    return res.scalars().all()
 
+def expense_amount(adjusted: bool = False):
+    condition = and_(TransactionModel.type == TransactionType.EXPENSE,
+                     TransactionModel.homogenized_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
+    if adjusted:
+        condition = and_(condition, func.abs(TransactionModel.homogenized_amount) < BURN_RATE_AMOUNT_THRESHOLD)
+    return case((condition, TransactionModel.homogenized_amount))
 
-async def get_categories_dict(db: AsyncSession, with_subcategories=False):
-    res = await get_categories(db)
-    categories =  {cat.id: Category(cat.id, cat.name, cat.color, cat.parent_category_id) for cat in res}
 
-    if with_subcategories:
-        for cat in categories.values():
-            if cat.parent_category_id:
-                cat.parent_category = categories[cat.parent_category_id]
+async def get_totals(db: AsyncSession, year: int, month: Optional[int]):
+    if not month:
+        return await get_yearly_totals(db, year)
 
-    return categories
+    _from, _to = timeframe_to_timestamps(year, month)
+    q = (select(func.sum(income_amount()), func.sum(expense_amount()))
+         .where(TransactionModel.type.in_((TransactionType.EXPENSE, TransactionType.INCOME)))
+         .where(TransactionModel.timestamp >= _from)
+         .where(TransactionModel.timestamp < _to)
+         .where(TransactionModel.is_scheduled.is_(False)))
+    res = await db.execute(q)
+    incomes, expenses = res.one()
+    return {'sum_income': incomes, 'sum_expenses': expenses}
 
 
-async def get_totals(db: AsyncSession, year: int, month: Optional[int]):
-    _from, _to = timeframe_to_timestamps(year, month)
-    q_expenses = (select(func.sum(TransactionModel.homogenized_amount))
-                  .where(TransactionModel.type == TransactionType.EXPENSE)
-                  .where(TransactionModel.timestamp >= _from)
-                  .where(TransactionModel.timestamp < _to)
-                  .where(TransactionModel.homogenized_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
-                  .where(TransactionModel.is_scheduled.is_(False)))
-    q_incomes = (select(func.sum(TransactionModel.destination_amount))
-                 .where(TransactionModel.type == TransactionType.INCOME)
-                 .where(TransactionModel.timestamp >= _from)
-                 .where(TransactionModel.timestamp < _to)
-                 .where(TransactionModel.is_scheduled.is_(False)))
-    res_expenses = await db.execute(q_expenses)
-    res_incomes = await db.execute(q_incomes)
-    expenses = res_expenses.scalar()
-    incomes = res_incomes.scalar()
+async def get_yearly_totals(db: AsyncSession, year: int):
+    q = (select(func.sum(MonthlyRollupModel.income), func.sum(MonthlyRollupModel.expense))
+         .where(MonthlyRollupModel.year == year))
+    res = await db.execute(q)
+    incomes, expenses = res.one()
     return {'sum_income': incomes, 'sum_expenses': expenses}
 
 
 async def get_cashflow(db: AsyncSession, year: int, month: Optional[int]):
+    if not month:
+        return await get_yearly_cashflow(db, year)
+
     _from, _to = timeframe_to_timestamps(year, month)
+    q = (
+        select(func.cast(func.strftime('%Y', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.YEAR),
+               func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.MONTH),
+               func.sum(income_amount(capped=True)),
+               func.sum(expense_amount()))
+        .where(TransactionModel.type.in_((TransactionType.EXPENSE, TransactionType.INCOME)))
+        .where(TransactionModel.timestamp >= _from)
+        .where(TransactionModel.timestamp < _to)
+        .where(TransactionModel.is_scheduled.is_(False))
+        .group_by(TF.MONTH)
+        .order_by(TF.MONTH)
+    )
+    res = await db.execute(q)
+    return build_cashflow_from_rows(res.all())
 
-    def get_query(amount_field, transaction_type):
-        fields = [
-            func.cast(func.strftime('%Y', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.YEAR),
-            func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.MONTH),
-            func.sum(amount_field)
-        ]
-
-        return (
-            select(*fields)
-            .where(TransactionModel.type == transaction_type)
-            .where(TransactionModel.timestamp >= _from)
-            .where(TransactionModel.timestamp < _to)
-            .where(amount_field < MAX_TRANSACTION_AMOUNT_THRESHOLD)
-            .where(TransactionModel.is_scheduled.is_(False))
-            .group_by(TF.MONTH)
-            .order_by(TF.MONTH)
-        )
 
-    q = get_query(TransactionModel.destination_amount, TransactionType.INCOME)
+async def get_yearly_cashflow(db: AsyncSession, year: int):
+    q = (
+        select(MonthlyRollupModel.year,
+               MonthlyRollupModel.month,
+               MonthlyRollupModel.capped_income,
+               MonthlyRollupModel.expense)
+        .where(MonthlyRollupModel.year == year)
+        .order_by(MonthlyRollupModel.month)
+    )
     res = await db.execute(q)
-    result_income = [i._tuple() for i in res]
+    return build_cashflow_from_rows(res.all())
 
-    q = get_query(TransactionModel.homogenized_amount, TransactionType.EXPENSE)
-    res = await db.execute(q)
-    result_expense = [i._tuple() for i in res]
 
+def build_cashflow_from_rows(rows):
+    result_expense = [(y, m, expense) for y, m, _, expense in rows if expense is not None]
+    result_income = [(y, m, income) for y, m, income, _ in rows if income is not None]
+    return build_cashflow(result_expense, result_income)
+
+
+def build_cashflow(result_expense, result_income):
     cashflow_dict = {}
     for item in result_expense:
         c_month = CashFlowMonth(*item)
@@ -118,36 +128,55 @@ async def get_cashflow(db: AsyncSession, year: int, month: Optional[int]):
 
 
 async def get_burn_rate(db: AsyncSession, year: int, month: Optional[int]):
-    _from, _to = timeframe_to_timestamps(year, month)
-    timeframe, key = (TF.DAY, 2) if month else (TF.MONTH, 1)
-
+    if not month:
+        return await get_yearly_burn_rate(db, year)
 
-    q_base = (
+    _from, _to = timeframe_to_timestamps(year, month)
+    q = (
         select(func.cast(func.strftime('%Y', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.YEAR),
                func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.MONTH),
                func.cast(func.strftime('%d', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.DAY),
-               func.sum(TransactionModel.homogenized_amount))
-            .where(TransactionModel.type == TransactionType.EXPENSE)
-            .where(TransactionModel.timestamp >= _from)
-            .where(TransactionModel.timestamp < _to)
-            .where(TransactionModel.homogenized_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
-            .where(TransactionModel.is_scheduled.is_(False))
+               func.sum(TransactionModel.homogenized_amount),
+               func.sum(expense_amount(adjusted=True)))
+        .where(TransactionModel.type == TransactionType.EXPENSE)
+        .where(TransactionModel.timestamp >= _from)
+        .where(TransactionModel.timestamp < _to)
+        .where(TransactionModel.homogenized_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
+        .where(TransactionModel.is_scheduled.is_(False))
+        .group_by(TF.DAY)
     )
+    res = await db.execute(q)
+    return build_burn_rate_from_rows(year, month, res.all())
+
 
-    q_raw = q_base.group_by(timeframe)
-    res_raw = await db.execute(q_raw)
-    result_raw = [i._tuple() for i in res_raw]
+async def get_yearly_burn_rate(db: AsyncSession, year: int):
+    q = (
+        select(MonthlyRollupModel.year,
+               MonthlyRollupModel.month,
+               literal(1),
+               MonthlyRollupModel.expense,
+               MonthlyRollupModel.adjusted_expense)
+        .where(MonthlyRollupModel.year == year)
+        .where(MonthlyRollupModel.expense.is_not(None))
+    )
+    res = await db.execute(q)
+    return build_burn_rate_from_rows(year, None, res.all())
+
+
+def build_burn_rate_from_rows(year: int, month: Optional[int], rows):
+    result_raw = [(y, m, d, raw) for y, m, d, raw, _ in rows]
+    result_adjusted = [(y, m, d, adjusted) for y, m, d, _, adjusted in rows if adjusted is not None]
+    return build_burn_rate(year, month, result_raw, result_adjusted)
+
+
+def build_burn_rate(year: int, month: Optional[int], result_raw, result_adjusted):
+    timeframe, key = (TF.DAY, 2) if month else (TF.MONTH, 1)
     dict_raw = {res[key]: res for res in result_raw}
     if not dict_raw:
         return {}
 
     date_range = range(min(dict_raw.keys()) if dict_raw.keys() else 1,
                        max(dict_raw.keys()) + 1 if dict_raw.keys() else 13)
-
-    q_adjusted = (q_base.where(func.abs(TransactionModel.homogenized_amount) < BURN_RATE_AMOUNT_THRESHOLD)
-                  .group_by(timeframe))
-    res_adjusted = await db.execute(q_adjusted)
-    result_adjusted = [i._tuple() for i in res_adjusted]
     dict_adjusted = {res[key]: res for res in result_adjusted}
 
     burn_rate_dict = {}
@@ -184,6 +213,9 @@ async def get_burn_rate(db: AsyncSession, year: int, month: Optional[int]):
 
 
 async def get_subcategory_amounts(db: AsyncSession, year: int, month: Optional[int]):
+    if not month:
+        return await get_yearly_subcategory_amounts(db, year)
+
     _from, _to = timeframe_to_timestamps(year, month)
     q = (select(CategoryModel.id,
                 CategoryModel.name,
@@ -201,6 +233,26 @@ async def get_subcategory_amounts(db: AsyncSession, year: int, month: Optional[i
     res = await db.execute(q)
     result = [i._tuple() for i in res]
 
+    return build_subcategory_amounts(result)
+
+
+async def get_yearly_subcategory_amounts(db: AsyncSession, year: int):
+    q = (select(CategoryModel.id,
+                CategoryModel.name,
+                CategoryModel.color,
+                CategoryModel.parent_category_id,
+                func.sum(MonthlyCategoryRollupModel.amount),
+                ).join(MonthlyCategoryRollupModel)
+         .where(MonthlyCategoryRollupModel.year == year)
+         .where(CategoryModel.type == CategoryType.EXPENSE)
+         .group_by(CategoryModel.name))
+    res = await db.execute(q)
+    result = [i._tuple() for i in res]
+
+    return build_subcategory_amounts(result)
+
+
+def build_subcategory_amounts(result):
     category_amounts = []
     for item in result:
         cat = Category(*item[:-1])
@@ -210,25 +262,22 @@ async def get_subcategory_amounts(db: AsyncSession, year: int, month: Optional[i
     return category_amounts
 
 
-async def get_category_amounts(db: AsyncSession, year: int, month: Optional[int]):
-    _from, _to = timeframe_to_timestamps(year, month)
+async def get_category_amounts(db: AsyncSession, year: int, month: Optional[int], depth: int = 0):
     subc_amounts = await get_subcategory_amounts(db, year, month)
-    subc_dict = {item.category.id: item for item in subc_amounts}
-    categories_dict = await get_categories_dict(db)
+    return build_category_amounts(subc_amounts, get_category_tree(db), depth)
 
 
-    for key in list(subc_dict.keys()):
-        cat_amt = subc_dict[key]
-        parent_id = cat_amt.category.parent_category_id
-        if parent_id:
-            if parent_id in subc_dict:
-                subc_dict[parent_id].amount += cat_amt.amount
-            else:
-                cat = categories_dict[parent_id]
-                subc_dict[parent_id] = CategoryAmount(cat, cat_amt.amount)
-            del subc_dict[key]
+def build_category_amounts(subc_amounts, tree: CategoryTree, depth: int = 0):
+    amounts = {}
+    for item in subc_amounts:
+        category_id = tree.ancestor(item.category.id, depth)
+        if category_id in amounts:
+            amounts[category_id].amount += item.amount
+        else:
+            category = item.category if category_id == item.category.id else tree.categories[category_id]
+            amounts[category_id] = CategoryAmount(category, item.amount)
 
-    category_amounts = list(subc_dict.values())
+    category_amounts = list(amounts.values())
     category_amounts.sort(key=lambda x: x.amount, reverse=True)
 
     return category_amounts
@@ -241,53 +290,111 @@ async def get_transactions(db: AsyncSession,
                            transaction_type: Optional[int],
                            account_id: Optional[int],
                            category_id: Optional[int],
-                           threshold: Optional[int]):
+                           threshold: Optional[int],
+                           limit: Optional[int] = None,
+                           cursor: Optional[str] = None):
+    accounts = get_reference_data(db).accounts
+    tree = get_category_tree(db)
+    q = transactions_query(tree, year, month, day, transaction_type, account_id, category_id, threshold, cursor)
+    if limit:
+        q = q.limit(limit + 1)
+
+    res = await db.execute(q)
+    transactions = [build_transaction(row, accounts, tree.categories) for row in res]
+    if not limit:
+        return transactions
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(transactions[-1].date, transactions[-1].id)
+    return {'transactions': transactions, 'next_cursor': next_cursor}
+
+
+async def stream_transactions(db: AsyncSession,
+                              year: int,
+                              month: Optional[int],
+                              day: Optional[int],
+                              transaction_type: Optional[int],
+                              account_id: Optional[int],
+                              category_id: Optional[int],
+                              threshold: Optional[int],
+                              limit: Optional[int] = None,
+                              cursor: Optional[str] = None):
+    accounts = get_reference_data(db).accounts
+    tree = get_category_tree(db)
+    q = transactions_query(tree, year, month, day, transaction_type, account_id, category_id, threshold, cursor)
+    if limit:
+        q = q.limit(limit)
+
+    res = await db.stream(q.execution_options(yield_per=TRANSACTIONS_STREAM_BATCH_SIZE))
+    async for rows in res.partitions():
+        yield [build_transaction(row, accounts, tree.categories) for row in rows]
+
+
+def transactions_query(tree: CategoryTree,
+                       year: int,
+                       month: Optional[int],
+                       day: Optional[int],
+                       transaction_type: Optional[int],
+                       account_id: Optional[int],
+                       category_id: Optional[int],
+                       threshold: Optional[int],
+                       cursor: Optional[str]):
     _from, _to = timeframe_to_timestamps(year, month, day)
-    categories = await get_categories_dict(db, with_subcategories=True)
-    accounts = await get_accounts_dict(db)
     if not transaction_type:
         transaction_type = TransactionType.EXPENSE
 
     q = (
-        select(TransactionModel)
+        select(TransactionModel.id,
+               TransactionModel.timestamp,
+               TransactionModel.account_id,
+               TransactionModel.destination_id,
+               TransactionModel.homogenized_amount,
+               TransactionModel.comment)
         .where(TransactionModel.type == transaction_type)
         .where(TransactionModel.timestamp >= _from)
         .where(TransactionModel.timestamp < _to)
         .where(TransactionModel.is_scheduled.is_(False))
-        .order_by(TransactionModel.timestamp.desc())
+        .order_by(TransactionModel.timestamp.desc(), TransactionModel.id.desc())
     )
 
+    if cursor:
+        q = q.where(tuple_(TransactionModel.timestamp, TransactionModel.id) < decode_cursor(cursor))
+
     if account_id:
         q = q.where(TransactionModel.account_id == account_id)
 
     if category_id:
-        category_ids = [cat.id for cat in categories.values() if cat.parent_category_id == category_id] + [category_id]
-        q = q.where(TransactionModel.destination_id.in_(category_ids))
+        q = q.where(TransactionModel.destination_id.in_(tree.subtree(category_id)))
 
     if threshold:
         q = q.where(TransactionModel.homogenized_amount < threshold)
 
-    res = await db.execute(q)
-    transactions_db = res.scalars().all()
-    transactions = []
-    for tr in transactions_db:
-        transactions.append(Transaction(
-            id=tr.id,
-            date=tr.timestamp,
-            account=accounts[tr.account_id],
-            category=categories[tr.destination_id],
-            amount=tr.homogenized_amount,
-            notes=tr.comment
-        ))
-    return transactions
+    return q
+
+
+def build_transaction(row, accounts: dict, categories: dict):
+    tr_id, timestamp, account_id, destination_id, amount, comment = row
+    return Transaction(id=tr_id,
+                       date=timestamp,
+                       account=accounts[account_id],
+                       category=categories[destination_id],
+                       amount=amount,
+                       notes=comment)
 
 
 async def get_biggest_expenses(db: AsyncSession, year: int, month: Optional[int], limit: int = 30):
     _from, _to = timeframe_to_timestamps(year, month)
-    categories = await get_categories_dict(db, with_subcategories=True)
-    accounts = await get_accounts_dict(db)
+    accounts = get_reference_data(db).accounts
+    categories = get_category_tree(db).categories
     q = (
-        select(TransactionModel)
+        select(TransactionModel.id,
+               TransactionModel.timestamp,
+               TransactionModel.account_id,
+               TransactionModel.destination_id,
+               TransactionModel.homogenized_amount,
+               TransactionModel.comment)
         .where(TransactionModel.type == TransactionType.EXPENSE)
         .where(TransactionModel.timestamp >= _from)
         .where(TransactionModel.timestamp < _to)
@@ -296,53 +403,29 @@ async def get_biggest_expenses(db: AsyncSession, year: int, month: Optional[int]
         .limit(limit)
     )
     res = await db.execute(q)
-    transactions_db = res.scalars().all()
-    transactions = []
-    for tr in transactions_db:
-        transactions.append(Transaction(
-            id=tr.id,
-            date=tr.timestamp,
-            account=accounts[tr.account_id],
-            category=categories[tr.destination_id],
-            amount=tr.homogenized_amount,
-            notes=tr.comment
-        ))
-    return transactions
-
-
-async def get_savings(db: AsyncSession, year: int, month: Optional[int]):
-    _from, _to = timeframe_to_timestamps(year, month)
-    separators = savings_separators(year, month)
+    return [build_transaction(row, accounts, categories) for row in res]
+
+
+async def get_savings(db: AsyncSession,
+                      year: int,
+                      month: Optional[int],
+                      to_year: Optional[int] = None,
+                      currency: Optional[str] = None):
+    if to_year:
+        _from, _to = timeframe_to_timestamps(year)[0], timeframe_to_timestamps(to_year)[1]
+        separators = savings_range_separators(year, to_year)
+    else:
+        _from, _to = timeframe_to_timestamps(year, month)
+        separators = savings_separators(year, month)
     accounts = await get_accounts(db, currency_id=10051)
     account_names = {acc.id: acc.name for acc in accounts}
     colors = {acc.name: acc.color for acc in accounts}
     colors['Total'] = 16777215
 
-    q = (
-        select(BalanceHistoryModel)
-        .where(BalanceHistoryModel.timestamp >= _from)
-        .where(BalanceHistoryModel.timestamp < _to)
-        .where(BalanceHistoryModel.account_id.in_(account_names.keys()))
-        .order_by(BalanceHistoryModel.timestamp.asc())
-    )
-
-    res = await db.execute(q)
-    balance_histories = res.scalars().all()
-    bh_per_account = {acc_id: {} for acc_id in account_names}
-    for bh in balance_histories:
-        bh_per_account[bh.account_id][bh.timestamp] = bh.balance
-
-    starting_balances = {}
-    for acc_id in account_names:
-        q = (
-            select(BalanceHistoryModel.balance)
-            .where(BalanceHistoryModel.account_id == acc_id)
-            .where(BalanceHistoryModel.timestamp < _from)
-            .order_by(BalanceHistoryModel.timestamp.desc())
-            .limit(1)
-        )
-        res = await db.execute(q)
-        starting_balances[acc_id] = res.scalar() or 0
+    if currency:
+        balances_at = await get_converted_balances_at(db, account_names.keys(), separators.values(), currency)
+    else:
+        balances_at = await get_balances_at(db, account_names.keys(), separators.values(), _from, _to)
 
     labels = []
     balances = {acc_name: [] for acc_name in account_names.values()}
@@ -351,14 +434,13 @@ async def get_savings(db: AsyncSession, year: int, month: Optional[int]):
         labels.append(sep)
         total = 0
         for acc_id, acc_name in account_names.items():
-            timestamps = [ts for ts in bh_per_account[acc_id].keys() if ts <= timestamp]
-            max_ts = max(timestamps) if timestamps else None
-            balance = bh_per_account[acc_id][max_ts] if max_ts else starting_balances[acc_id]
+            balance = balances_at[timestamp][acc_id]
             balances[acc_name].append(balance)
             total += balance
 
         balances['Total'].append(total)
-    change = balances['Total'][-1] - balances['Total'][0]
+    # periods that haven't started yet have no separators
+    change = balances['Total'][-1] - balances['Total'][0] if labels else 0
 
     return {'labels': labels,
             'colors': colors,
@@ -366,79 +448,289 @@ async def get_savings(db: AsyncSession, year: int, month: Optional[int]):
             'change': change}
 
 
-async def prepare_data(db: AsyncSession):
-    version_query = await db.execute(text('PRAGMA user_version;'))
-    version = version_query.scalar()
-    if version < 99:
-        print('Translating the DB')
-        with open(PREPARATORY_QUERIES_FILE) as f:
-            for stmt in f.read().split('\n\n'):
-                await db.execute(text(stmt))
-        await db.commit()
+async def get_balances_at(db: AsyncSession, account_ids, timestamps, _from: int, _to: int):
+    q = (
+        select(BalanceHistoryModel.account_id, BalanceHistoryModel.timestamp, BalanceHistoryModel.balance)
+        .where(BalanceHistoryModel.timestamp >= _from)
+        .where(BalanceHistoryModel.timestamp < _to)
+        .where(BalanceHistoryModel.account_id.in_(account_ids))
+        .order_by(BalanceHistoryModel.timestamp, BalanceHistoryModel.id)
+    )
 
-        print('Compiling balance history')
-        await compile_balances_history(db)
-        print('Compiling daily balance history')
-        await compile_daily_balance_history(db)
-        print('Compiling daily cashflow')
-        await compile_daily_cashflow(db)
+    res = await db.execute(q)
+    timestamps_per_account = {acc_id: [] for acc_id in account_ids}
+    balances_per_account = {acc_id: [] for acc_id in account_ids}
+    for acc_id, timestamp, balance in res:
+        timestamps_per_account[acc_id].append(timestamp)
+        balances_per_account[acc_id].append(balance)
+
+    starting_balances = await get_latest_balances(db, account_ids, _from)
+
+    balances_at = {}
+    for timestamp in timestamps:
+        balances_at[timestamp] = {}
+        for acc_id in account_ids:
+            i = bisect_right(timestamps_per_account[acc_id], timestamp)
+            balance = balances_per_account[acc_id][i - 1] if i else starting_balances.get(acc_id) or 0
+            balances_at[timestamp][acc_id] = balance
+
+    return balances_at
+
+
+async def get_converted_balances_at(db: AsyncSession, account_ids, timestamps, currency: str):
+    res = await db.execute(select(func.max(DailyAccountBalanceModel.timestamp)))
+    last_day = res.scalar() or 0
+    days = {timestamp: min(int(timestamp), last_day) for timestamp in timestamps}
+
+    value, joins = converted_balance(currency)
+    q = select(DailyAccountBalanceModel.account_id, DailyAccountBalanceModel.timestamp, value)
+    for target, on_clause in joins:
+        q = q.join(target, on_clause)
+    q = (
+        q.where(DailyAccountBalanceModel.account_id.in_(account_ids))
+        .where(DailyAccountBalanceModel.timestamp.in_(set(days.values())))
+    )
 
+    res = await db.execute(q)
+    converted = {(acc_id, day): balance for acc_id, day, balance in res}
+    return {timestamp: {acc_id: converted.get((acc_id, day), 0) for acc_id in account_ids}
+            for timestamp, day in days.items()}
 
-async def compile_balances_history(db: AsyncSession):
-    accounts = await get_accounts(db, with_archived=True)
-    latest_balances = {acc.id: acc.starting_balance or 0 for acc in accounts}
+
+async def get_dashboard(db: AsyncSession, year: int, month: Optional[int]):
+    _from, _to = timeframe_to_timestamps(year, month)
+    tree = get_category_tree(db)
+    categories = tree.categories
+    expense_ids = tree.expense_ids
+    accounts = get_reference_data(db).accounts
 
     q = (
-        select(TransactionModel)
+        select(TransactionModel.id,
+               TransactionModel.type,
+               TransactionModel.timestamp,
+               TransactionModel.account_id,
+               TransactionModel.destination_id,
+               TransactionModel.destination_amount,
+               TransactionModel.homogenized_amount,
+               TransactionModel.comment)
+        .where(TransactionModel.type.in_((TransactionType.EXPENSE, TransactionType.INCOME)))
+        .where(TransactionModel.timestamp >= _from)
+        .where(TransactionModel.timestamp < _to)
         .where(TransactionModel.is_scheduled.is_(False))
         .order_by(TransactionModel.timestamp.asc())
     )
     res = await db.execute(q)
-    transactions = res.scalars().all()
-    for trans in transactions:
-        if trans.type == TransactionType.INCOME:
-            latest_balances[trans.account_id] += trans.amount
-            history = BalanceHistoryModel(account_id=trans.account_id,
-                                          transaction_id=trans.id,
-                                          timestamp=trans.timestamp,
-                                          balance=round(latest_balances[trans.account_id], 2))
-            db.add(history)
-        elif trans.type == TransactionType.EXPENSE:
-            latest_balances[trans.account_id] -= trans.amount
-            history = BalanceHistoryModel(account_id=trans.account_id,
-                                          transaction_id=trans.id,
-                                          timestamp=trans.timestamp,
-                                          balance=round(latest_balances[trans.account_id], 2))
-            db.add(history)
-        else:
-            latest_balances[trans.account_id] -= trans.amount
-            latest_balances[trans.destination_id] += trans.destination_amount
-            history1 = BalanceHistoryModel(account_id=trans.account_id,
-                                           transaction_id=trans.id,
-                                           timestamp=trans.timestamp,
-                                           balance=round(latest_balances[trans.account_id], 2))
-            history2 = BalanceHistoryModel(account_id=trans.destination_id,
-                                           transaction_id=trans.id,
-                                           timestamp=trans.timestamp,
-                                           balance=round(latest_balances[trans.destination_id], 2))
-            db.add(history1)
-            db.add(history2)
-
-        await db.flush()
 
+    sum_income = None
+    sum_expenses = None
+    income_months = defaultdict(float)
+    expense_months = defaultdict(float)
+    raw_periods = defaultdict(float)
+    adjusted_periods = defaultdict(float)
+    subcategory_sums = defaultdict(float)
+    subcategories = {}
+    expenses = []
+    for trans in res:
+        trans_id, trans_type, timestamp, account_id, destination_id, destination_amount, amount, comment = trans
+        date = datetime.fromtimestamp(timestamp)
+
+        if trans_type == TransactionType.INCOME:
+            sum_income = (sum_income or 0) + destination_amount
+            if destination_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD:
+                income_months[date.year, date.month] += destination_amount
+            continue
+
+        expenses.append(trans)
+        if amount >= MAX_TRANSACTION_AMOUNT_THRESHOLD:
+            continue
+
+        sum_expenses = (sum_expenses or 0) + amount
+        expense_months[date.year, date.month] += amount
+
+        period = (date.year, date.month, date.day if month else 1)
+        raw_periods[period] += amount
+        if abs(amount) < BURN_RATE_AMOUNT_THRESHOLD:
+            adjusted_periods[period] += amount
+
+        if destination_id in expense_ids:
+            cat = categories[destination_id]
+            subcategories[cat.name] = (cat.id, cat.name, cat.color, cat.parent_category_id)
+            subcategory_sums[cat.name] += amount
+
+    subcategory_amounts = build_subcategory_amounts(
+        [(*subcategories[name], subcategory_sums[name]) for name in sorted(subcategory_sums)])
+    biggest_expenses = [
+        Transaction(id=tr[0],
+                    date=tr[2],
+                    account=accounts[tr[3]],
+                    category=categories[tr[4]],
+                    amount=tr[6],
+                    notes=tr[7])
+        for tr in heapq.nlargest(30, expenses, key=lambda tr: tr[6])
+    ]
+
+    return {
+        'totals': {'sum_income': sum_income, 'sum_expenses': sum_expenses},
+        'cashflow': build_cashflow([(*key, expense_months[key]) for key in sorted(expense_months)],
+                                   [(*key, income_months[key]) for key in sorted(income_months)]),
+        'burn_rate': build_burn_rate(year, month,
+                                     [(*key, raw_periods[key]) for key in raw_periods],
+                                     [(*key, adjusted_periods[key]) for key in adjusted_periods]),
+        'subcategory_amounts': subcategory_amounts,
+        'category_amounts': build_category_amounts(subcategory_amounts, tree),
+        'biggest_expenses': biggest_expenses,
+        'savings': await get_savings(db, year, month),
+        'daily_balances': await get_daily_balance_history(db, year, month),
+    }
+
+
+async def prepare_data(db: AsyncSession, previous_db_file: Optional[str] = None):
+    version_query = await db.execute(text('PRAGMA user_version;'))
+    version = version_query.scalar()
+    if version < PREPARED_DB_VERSION:
+        phases = {}
+        with preparation_phase(phases, 'translate'):
+            await execute_queries_file(db, PREPARATORY_QUERIES_FILE)
+
+        since = None
+        if previous_db_file:
+            with preparation_phase(phases, 'import_previous_data'):
+                since = await import_previous_data(db, previous_db_file)
+        if since is not None:
+            print(f'Importing {previous_db_file} up to {datetime.fromtimestamp(since)}')
+
+        # the compile steps look up balance_history by account and time, the remaining indexes come last
+        with preparation_phase(phases, 'create_compile_indexes'):
+            await execute_queries_file(db, COMPILE_INDEX_QUERIES_FILE)
+        with preparation_phase(phases, 'compile_balances_history'):
+            await compile_balances_history(db, since)
+        with preparation_phase(phases, 'compile_daily_balance_history'):
+            await compile_daily_balance_history(db, since)
+        with preparation_phase(phases, 'compile_daily_cashflow'):
+            await compile_daily_cashflow(db, since)
+        with preparation_phase(phases, 'compile_daily_exchange_rates'):
+            await compile_daily_exchange_rates(db)
+        with preparation_phase(phases, 'compile_monthly_rollup'):
+            await compile_monthly_rollup(db)
+        with preparation_phase(phases, 'create_indexes'):
+            await execute_queries_file(db, INDEX_QUERIES_FILE)
+
+        await db.execute(insert(PreparationPhaseModel),
+                         [{'phase': phase, 'seconds': seconds} for phase, seconds in phases.items()])
+        await db.commit()
+
+
+async def get_preparation_phases(db: AsyncSession):
+    res = await db.execute(select(PreparationPhaseModel.phase, PreparationPhaseModel.seconds)
+                           .order_by(PreparationPhaseModel.id))
+    return res.all()
+
+
+async def execute_queries_file(db: AsyncSession, queries_file: str):
+    with open(queries_file) as f:
+        for stmt in f.read().split('\n\n'):
+            await db.execute(text(stmt))
     await db.commit()
 
 
-async def get_latest_balance_for_account_to_date(db: AsyncSession, account_id: int, timestamp: int):
-    q = (
+async def import_previous_data(db: AsyncSession, previous_db_file: str) -> Optional[int]:
+    accounts_columns = 'id, type, currency_id, starting_balance, is_in_balance, show_order, is_archived'
+    q_accounts = text(f'''
+        SELECT count(*) FROM (
+            SELECT {accounts_columns} FROM main.accounts EXCEPT SELECT {accounts_columns} FROM previous.accounts
+            UNION ALL
+            SELECT {accounts_columns} FROM previous.accounts EXCEPT SELECT {accounts_columns} FROM main.accounts
+        );
+    ''')
+    q_changed = text('''
+        SELECT min(timestamp) FROM (
+            SELECT timestamp FROM (SELECT * FROM main.transactions EXCEPT SELECT * FROM previous.transactions)
+            UNION ALL
+            SELECT timestamp FROM (SELECT * FROM previous.transactions EXCEPT SELECT * FROM main.transactions)
+        );
+    ''')
+    q_compiled_to = text('SELECT max(timestamp) FROM previous.daily_balance_history;')
+
+    since = None
+    async with db.bind.connect() as conn:
+        await conn.execute(text('ATTACH DATABASE :file AS previous;'), {'file': previous_db_file})
+        accounts_changed = (await conn.execute(q_accounts)).scalar()
+        compiled_to = (await conn.execute(q_compiled_to)).scalar()
+        if not accounts_changed and compiled_to is not None:
+            changed_from = (await conn.execute(q_changed)).scalar()
+            since = day_start(min(compiled_to, changed_from) if changed_from is not None else compiled_to)
+
+            for model in (BalanceHistoryModel, DailyBalanceHistoryModel, DailyAccountBalanceModel,
+                          DailyAccountCashflowModel):
+                await conn.execute(text(f'INSERT INTO main.{model.__tablename__} '
+                                        f'SELECT * FROM previous.{model.__tablename__} WHERE timestamp < :since;'),
+                                   {'since': since})
+            await conn.commit()
+
+        await conn.execute(text('DETACH DATABASE previous;'))
+
+    return since
+
+
+async def get_latest_balances(db: AsyncSession, account_ids, before: int):
+    latest_balance = (
         select(BalanceHistoryModel.balance)
-        .where(BalanceHistoryModel.account_id == account_id)
-        .where(BalanceHistoryModel.timestamp <= timestamp)
-        .order_by(BalanceHistoryModel.id.desc())
+        .where(BalanceHistoryModel.account_id == AccountModel.id)
+        .where(BalanceHistoryModel.timestamp < before)
+        .order_by(BalanceHistoryModel.timestamp.desc(), BalanceHistoryModel.id.desc())
         .limit(1)
+        .correlate(AccountModel)
+        .scalar_subquery()
     )
+    q = select(AccountModel.id, latest_balance).where(AccountModel.id.in_(account_ids))
     res = await db.execute(q)
-    return res.scalar()
+    return {account_id: balance for account_id, balance in res if balance is not None}
+
+
+async def compile_balances_history(db: AsyncSession, since: Optional[int] = None):
+    accounts = await get_accounts(db, with_archived=True)
+    latest_balances = {acc.id: acc.starting_balance or 0 for acc in accounts}
+    if since is not None:
+        latest_balances.update(await get_latest_balances(db, latest_balances.keys(), since))
+
+    q = (
+        select(TransactionModel.id,
+               TransactionModel.type,
+               TransactionModel.timestamp,
+               TransactionModel.account_id,
+               TransactionModel.destination_id,
+               TransactionModel.amount,
+               TransactionModel.destination_amount)
+        .where(TransactionModel.is_scheduled.is_(False))
+        .order_by(TransactionModel.timestamp.asc(), TransactionModel.id.asc())
+    )
+    if since is not None:
+        q = q.where(TransactionModel.timestamp >= since)
+    res = await db.execute(q)
+
+    histories = []
+    for trans_id, trans_type, timestamp, account_id, destination_id, amount, destination_amount in res:
+        is_transfer = trans_type not in (TransactionType.INCOME, TransactionType.EXPENSE)
+        if trans_type == TransactionType.INCOME:
+            latest_balances[account_id] += amount
+        else:
+            latest_balances[account_id] -= amount
+        if is_transfer:
+            latest_balances[destination_id] += destination_amount
+
+        histories.append({'account_id': account_id,
+                          'transaction_id': trans_id,
+                          'timestamp': timestamp,
+                          'balance': round(latest_balances[account_id], 2)})
+        if is_transfer:
+            histories.append({'account_id': destination_id,
+                              'transaction_id': trans_id,
+                              'timestamp': timestamp,
+                              'balance': round(latest_balances[destination_id], 2)})
+
+    if histories:
+        await db.execute(insert(BalanceHistoryModel), histories)
+    await db.commit()
 
 
 async def get_first_transaction_timestamp(db: AsyncSession) -> datetime:
@@ -450,31 +742,119 @@ async def get_first_transaction_timestamp(db: AsyncSession) -> datetime:
     return datetime.fromtimestamp(res.scalar())
 
 
-async def compile_daily_balance_history(db: AsyncSession):
+async def compile_daily_balance_history(db: AsyncSession, since: Optional[int] = None):
     accounts = await get_accounts(db, with_archived=True)
-    accounts_in_balance = {acc.id: acc for acc in accounts if acc.is_in_balance}
+    account_ids = [acc.id for acc in accounts]
+    accounts_in_balance = {acc.id for acc in accounts if acc.is_in_balance}
+
+    q = (
+        select(BalanceHistoryModel.account_id, BalanceHistoryModel.timestamp, BalanceHistoryModel.balance)
+        .where(BalanceHistoryModel.account_id.in_(account_ids))
+        .order_by(BalanceHistoryModel.account_id, BalanceHistoryModel.timestamp, BalanceHistoryModel.id)
+    )
+    latest_balances = {acc_id: None for acc_id in account_ids}
+    if since is not None:
+        q = q.where(BalanceHistoryModel.timestamp >= since)
+        latest_balances.update(await get_latest_balances(db, account_ids, since))
+    res = await db.execute(q)
+    histories = {acc_id: [] for acc_id in account_ids}
+    for account_id, timestamp, balance in res:
+        histories[account_id].append((timestamp, balance))
+    cursors = {acc_id: 0 for acc_id in account_ids}
 
     min_datetime = await get_first_transaction_timestamp(db) + timedelta(days=1)
     current_datetime = datetime(min_datetime.year, min_datetime.month, min_datetime.day)
+    if since is not None:
+        current_datetime = max(current_datetime, datetime.fromtimestamp(since))
 
+    daily_balances = []
+    daily_account_balances = []
     while current_datetime < datetime.now():
         balance = 0
         timestamp = int(current_datetime.timestamp())
-        for acc in accounts_in_balance:
-            change = await get_latest_balance_for_account_to_date(db, acc, timestamp)
-            if change:
-                balance += change
+        for acc_id in account_ids:
+            history = histories[acc_id]
+            cursor = cursors[acc_id]
+            while cursor < len(history) and history[cursor][0] <= timestamp:
+                latest_balances[acc_id] = history[cursor][1]
+                cursor += 1
+            cursors[acc_id] = cursor
+            latest_balance = latest_balances[acc_id]
+            if latest_balance is not None:
+                daily_account_balances.append({'timestamp': timestamp, 'account_id': acc_id, 'balance': latest_balance})
+            if acc_id in accounts_in_balance and latest_balance:
+                balance += latest_balance
+
+        daily_balances.append({'timestamp': timestamp, 'balance': round(balance, 2)})
+        current_datetime += timedelta(days=1)
+
+    if daily_balances:
+        await db.execute(insert(DailyBalanceHistoryModel), daily_balances)
+    if daily_account_balances:
+        await db.execute(insert(DailyAccountBalanceModel), daily_account_balances)
+    await db.commit()
+
+
+async def compile_daily_exchange_rates(db: AsyncSession):
+    res = await db.execute(select(Currency.id, Currency.name_short, Currency.is_default))
+    currencies = res.all()
 
-        history = DailyBalanceHistoryModel(timestamp=timestamp, balance=round(balance, 2))
-        db.add(history)
-        await db.flush()
+    known_rates = defaultdict(list)
+    for rates_date, currency, rate in read_rates_history():
+        timestamp = int(datetime(rates_date.year, rates_date.month, rates_date.day).timestamp())
+        known_rates[currency].append((timestamp, rate))
 
+    min_datetime = await get_first_transaction_timestamp(db)
+    current_datetime = datetime(min_datetime.year, min_datetime.month, min_datetime.day)
+    timestamps = []
+    while current_datetime < datetime.now():
+        timestamps.append(int(current_datetime.timestamp()))
         current_datetime += timedelta(days=1)
 
+    daily_rates = []
+    for currency_id, name_short, is_default in currencies:
+        if is_default:
+            history = [(0, 1)]
+        elif name_short in known_rates:
+            history = known_rates[name_short]
+        elif name_short in FALLBACK_RATES:
+            history = [(0, FALLBACK_RATES[name_short])]
+        else:
+            print(f'No exchange rates for {name_short}')
+            continue
+
+        cursor = 0
+        for timestamp in timestamps:
+            while cursor + 1 < len(history) and history[cursor + 1][0] <= timestamp:
+                cursor += 1
+            daily_rates.append({'timestamp': timestamp, 'currency_id': currency_id, 'rate': history[cursor][1]})
+
+    if daily_rates:
+        await db.execute(insert(DailyExchangeRateModel), daily_rates)
     await db.commit()
 
 
-async def get_daily_balance_history(db: AsyncSession, year: int, month: Optional[int]):
+def converted_balance(currency: str):
+    source_rate = aliased(DailyExchangeRateModel)
+    target_rate = aliased(DailyExchangeRateModel)
+    value = DailyAccountBalanceModel.balance * source_rate.rate / target_rate.rate
+    joins = [
+        (AccountModel, AccountModel.id == DailyAccountBalanceModel.account_id),
+        (source_rate, and_(source_rate.timestamp == DailyAccountBalanceModel.timestamp,
+                           source_rate.currency_id == AccountModel.currency_id)),
+        (target_rate, target_rate.timestamp == DailyAccountBalanceModel.timestamp),
+        (Currency, and_(Currency.id == target_rate.currency_id, Currency.name_short == currency)),
+    ]
+    return value, joins
+
+
+async def get_daily_balance_history(db: AsyncSession,
+                                    year: int,
+                                    month: Optional[int],
+                                    currency: Optional[str] = None):
+    if currency:
+        return await get_converted_daily_balance_history(db, year, month, currency)
+
     _from, _to = timeframe_to_timestamps(year, month)
     q = (
         select(DailyBalanceHistoryModel)
@@ -492,47 +872,130 @@ async def get_daily_balance_history(db: AsyncSession, year: int, month: Optional
     return {'labels': labels, 'data': data}
 
 
-async def compile_daily_cashflow(db: AsyncSession):
-    accounts = await get_accounts(db)
+async def get_converted_daily_balance_history(db: AsyncSession, year: int, month: Optional[int], currency: str):
+    _from, _to = timeframe_to_timestamps(year, month)
+    value, joins = converted_balance(currency)
+    q_converted = select(DailyAccountBalanceModel.timestamp, func.sum(value).label('balance'))
+    for target, on_clause in joins:
+        q_converted = q_converted.join(target, on_clause)
+    q_converted = (
+        q_converted
+        .where(AccountModel.is_in_balance.is_(True))
+        .where(DailyAccountBalanceModel.timestamp >= _from)
+        .where(DailyAccountBalanceModel.timestamp < _to)
+        .group_by(DailyAccountBalanceModel.timestamp)
+        .subquery()
+    )
+    q = (
+        select(DailyBalanceHistoryModel.timestamp, func.round(func.coalesce(q_converted.c.balance, 0), 2))
+        .outerjoin(q_converted, q_converted.c.timestamp == DailyBalanceHistoryModel.timestamp)
+        .where(DailyBalanceHistoryModel.timestamp >= _from)
+        .where(DailyBalanceHistoryModel.timestamp < _to)
+        .order_by(DailyBalanceHistoryModel.timestamp.asc())
+    )
+
+    res = await db.execute(q)
+    daily_balances = res.all()
+
+    labels = [datetime.fromtimestamp(timestamp).day for timestamp, _ in daily_balances]
+    data = [balance for _, balance in daily_balances]
+
+    return {'labels': labels, 'data': data}
+
+
+async def compile_daily_cashflow(db: AsyncSession, since: Optional[int] = None):
+    # archived accounts keep their history, including the destination legs of transfers into them
+    accounts = await get_accounts(db, with_archived=True)
+    account_order = {acc.id: i for i, acc in enumerate(accounts)}
 
     min_datetime = await get_first_transaction_timestamp(db)
     current_datetime = datetime(min_datetime.year, min_datetime.month, min_datetime.day)
 
+    previous_timestamps = []
+    current_timestamps = []
     while current_datetime < datetime.now() + timedelta(days=1):
         previous_timestamp = int((current_datetime - timedelta(days=1)).timestamp())
-        current_timestamp = int(current_datetime.timestamp())
-        q = (
-            select(TransactionModel)
-            .where(TransactionModel.timestamp >= previous_timestamp)
-            .where(TransactionModel.timestamp < current_timestamp)
-            .where(TransactionModel.is_scheduled.is_(False))
-        )
+        if since is None or previous_timestamp >= since:
+            previous_timestamps.append(previous_timestamp)
+            current_timestamps.append(int(current_datetime.timestamp()))
+        current_datetime += timedelta(days=1)
 
-        res = await db.execute(q)
-        transactions = res.scalars().all()
-
-        for acc in accounts:
-            incomes = [trans.amount for trans in transactions
-                       if trans.account_id == acc.id and trans.type == TransactionType.INCOME]
-            expenses = [trans.amount for trans in transactions
-                        if trans.account_id == acc.id and trans.type == TransactionType.EXPENSE]
-            transfers_from = [trans.amount for trans in transactions
-                              if trans.account_id == acc.id and trans.type == TransactionType.TRANSFER]
-            transfers_to = [trans.destination_amount for trans in transactions
-                            if trans.destination_id == acc.id and trans.type == TransactionType.TRANSFER]
-
-            inflow = round(sum(incomes) + sum(transfers_to), 2)
-            outflow = round(sum(expenses) + sum(transfers_from), 2)
-
-            if inflow or outflow:
-                cashflow = DailyAccountCashflowModel(timestamp=previous_timestamp,
-                                                     account_id=acc.id,
-                                                     inflow=inflow,
-                                                     outflow=outflow)
-                db.add(cashflow)
-                await db.flush()
+    q = (
+        select(TransactionModel.timestamp,
+               TransactionModel.type,
+               TransactionModel.account_id,
+               TransactionModel.destination_id,
+               TransactionModel.amount,
+               TransactionModel.destination_amount)
+        .where(TransactionModel.is_scheduled.is_(False))
+        .order_by(TransactionModel.id.asc())
+    )
+    if since is not None:
+        q = q.where(TransactionModel.timestamp >= since)
+    res = await db.execute(q)
 
-        current_datetime += timedelta(days=1)
+    # (day, account id) -> [incomes, transfers to, expenses, transfers from]
+    flows = defaultdict(lambda: [0, 0, 0, 0])
+    for timestamp, trans_type, account_id, destination_id, amount, destination_amount in res:
+        day = bisect_right(current_timestamps, timestamp)
+        if day == len(current_timestamps) or timestamp < previous_timestamps[day]:
+            continue
+
+        if trans_type == TransactionType.INCOME and account_id in account_order:
+            flows[day, account_id][0] += amount
+        elif trans_type == TransactionType.EXPENSE and account_id in account_order:
+            flows[day, account_id][2] += amount
+        elif trans_type == TransactionType.TRANSFER:
+            if account_id in account_order:
+                flows[day, account_id][3] += amount
+            if destination_id in account_order:
+                flows[day, destination_id][1] += destination_amount
+
+    cashflows = []
+    for day, acc_id in sorted(flows, key=lambda key: (key[0], account_order[key[1]])):
+        incomes, transfers_to, expenses, transfers_from = flows[day, acc_id]
+        inflow = round(incomes + transfers_to, 2)
+        outflow = round(expenses + transfers_from, 2)
+
+        if inflow or outflow:
+            cashflows.append({'timestamp': previous_timestamps[day],
+                              'account_id': acc_id,
+                              'inflow': inflow,
+                              'outflow': outflow})
+
+    if cashflows:
+        await db.execute(insert(DailyAccountCashflowModel), cashflows)
+    await db.commit()
+
+
+async def compile_monthly_rollup(db: AsyncSession):
+    year = func.cast(func.strftime('%Y', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.YEAR)
+    month = func.cast(func.strftime('%m', TransactionModel.timestamp, 'unixepoch', 'localtime'), Integer).label(TF.MONTH)
+    q = (
+        select(year,
+               month,
+               func.sum(income_amount()),
+               func.sum(income_amount(capped=True)),
+               func.sum(expense_amount()),
+               func.sum(expense_amount(adjusted=True)))
+        .where(TransactionModel.type.in_((TransactionType.EXPENSE, TransactionType.INCOME)))
+        .where(TransactionModel.is_scheduled.is_(False))
+        .group_by(TF.YEAR, TF.MONTH)
+        .order_by(TF.YEAR, TF.MONTH)
+    )
+    await db.execute(insert(MonthlyRollupModel).from_select(
+        ['year', 'month', 'income', 'capped_income', 'expense', 'adjusted_expense'], q))
+
+    q = (
+        select(year, month, TransactionModel.destination_id, func.sum(TransactionModel.homogenized_amount))
+        .where(TransactionModel.type == TransactionType.EXPENSE)
+        .where(TransactionModel.homogenized_amount < MAX_TRANSACTION_AMOUNT_THRESHOLD)
+        .where(TransactionModel.is_scheduled.is_(False))
+        .group_by(TF.YEAR, TF.MONTH, TransactionModel.destination_id)
+        .order_by(TF.YEAR, TF.MONTH, TransactionModel.destination_id)
+    )
+    await db.execute(insert(MonthlyCategoryRollupModel).from_select(
+        ['year', 'month', 'category_id', 'amount'], q))
     await db.commit()
 
 
@@ -1,30 +1,48 @@
 from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .app_data import app_data
-from .db import get_db
-from .repo import get_accounts, get_categories, get_currencies, get_totals, get_cashflow, get_burn_rate, \
-    get_subcategory_amounts, get_category_amounts, get_biggest_expenses, get_savings, get_daily_balance_history, \
-    get_account_cashflow, get_transactions
+from .cache import cached, response_cache, to_json, etag_response
+from .config import DATA_BACKEND, TRANSACTIONS_PAGE_MAX_SIZE
+from .db import get_db, create_session
+from .metrics import metrics
+from .reference import reference_data, get_reference_data
+from .repo import get_totals, get_cashflow, get_burn_rate, get_subcategory_amounts, get_category_amounts, \
+    get_biggest_expenses, get_savings, get_daily_balance_history, get_account_cashflow, get_transactions, \
+    stream_transactions, get_dashboard
+
+if DATA_BACKEND == 'columnar':
+    from .columnar import get_totals, get_cashflow, get_burn_rate, get_subcategory_amounts, get_category_amounts
 
 router = APIRouter()
 
+CURSOR_PATTERN = r'^\d+:\d+$'
+CURRENCY_PATTERN = r'^[A-Z]{3}$'
+
+
+def known_currency(currency: Optional[str] = Query(None, pattern=CURRENCY_PATTERN),
+                   db: AsyncSession = Depends(get_db)):
+    if currency is not None and currency not in get_reference_data(db).currency_codes:
+        raise HTTPException(status_code=422, detail=f'Unknown currency {currency}')
+    return currency
+
 
 @router.get('/accounts')
-async def accounts(db: AsyncSession = Depends(get_db)):
-    return await get_accounts(db)
+async def accounts(request: Request):
+    return etag_response(request, reference_data.bodies['accounts'], reference_data.etags['accounts'])
 
 
 @router.get('/currencies')
-async def currencies(db: AsyncSession = Depends(get_db)):
-    return await get_currencies(db)
+async def currencies(request: Request):
+    return etag_response(request, reference_data.bodies['currencies'], reference_data.etags['currencies'])
 
 
 @router.get('/categories')
-async def categories(db: AsyncSession = Depends(get_db)):
-    return await get_categories(db)
+async def categories(request: Request):
+    return etag_response(request, reference_data.bodies['categories'], reference_data.etags['categories'])
 
 
 @router.get('/exchange_rates')
@@ -32,52 +50,84 @@ async def exchange_rates():
     return app_data.exchange_rates
 
 
+@router.get('/cache_stats')
+async def cache_stats():
+    return response_cache.stats
+
+
+@router.get('/metrics')
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
 @router.get('/totals')
+@cached
 async def totals(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_totals(db, y, m)
 
 
 @router.get('/cashflow')
+@cached
 async def cashflow(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_cashflow(db, y, m)
 
 
 @router.get('/burn_rate')
+@cached
 async def burn_rate(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_burn_rate(db, y, m)
 
 
 @router.get('/subcategory_amounts')
+@cached
 async def subcategory_amounts(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_subcategory_amounts(db, y, m)
 
 
 @router.get('/category_amounts')
-async def category_amounts(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
-    return await get_category_amounts(db, y, m)
+@cached
+async def category_amounts(y: int,
+                           m: Optional[int] = None,
+                           depth: int = Query(0, ge=0),
+                           db: AsyncSession = Depends(get_db)):
+    return await get_category_amounts(db, y, m, depth)
 
 
 @router.get('/biggest_expenses')
+@cached
 async def biggest_expenses(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_biggest_expenses(db, y, m)
 
 
 @router.get('/savings')
-async def savings(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
-    return await get_savings(db, y, m)
+@cached
+async def savings(y: int,
+                  m: Optional[int] = None,
+                  y_to: Optional[int] = None,
+                  currency: Optional[str] = Depends(known_currency),
+                  db: AsyncSession = Depends(get_db)):
+    if y_to and m:
+        raise HTTPException(status_code=422, detail='m cannot be combined with y_to')
+    return await get_savings(db, y, m, y_to, currency)
 
 
 @router.get('/daily_balances')
-async def daily_balances(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
-    return await get_daily_balance_history(db, y, m)
+@cached
+async def daily_balances(y: int,
+                         m: Optional[int] = None,
+                         currency: Optional[str] = Depends(known_currency),
+                         db: AsyncSession = Depends(get_db)):
+    return await get_daily_balance_history(db, y, m, currency)
 
 
 @router.get('/account_cashflows')
+@cached
 async def account_cashflows(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
     return await get_account_cashflow(db, y, m)
 
 
 @router.get('/transactions')
+@cached
 async def transactions(y: int,
                        m: Optional[int] = None,
                        d: Optional[int] = None,
@@ -85,5 +135,32 @@ async def transactions(y: int,
                        account_id: Optional[int] = None,
                        category_id: Optional[int] = None,
                        threshold: Optional[int] = None,
+                       limit: Optional[int] = Query(None, ge=1, le=TRANSACTIONS_PAGE_MAX_SIZE),
+                       cursor: Optional[str] = Query(None, pattern=CURSOR_PATTERN),
                        db: AsyncSession = Depends(get_db)):
-    return await get_transactions(db, y, m, d, tr_type, account_id, category_id, threshold)
+    return await get_transactions(db, y, m, d, tr_type, account_id, category_id, threshold, limit, cursor)
+
+
+@router.get('/transactions/stream')
+async def transactions_stream(y: int,
+                              m: Optional[int] = None,
+                              d: Optional[int] = None,
+                              tr_type: Optional[int] = None,
+                              account_id: Optional[int] = None,
+                              category_id: Optional[int] = None,
+                              threshold: Optional[int] = None,
+                              limit: Optional[int] = Query(None, ge=1),
+                              cursor: Optional[str] = Query(None, pattern=CURSOR_PATTERN)):
+    async def generate():
+        async with create_session() as session:
+            async for transactions in stream_transactions(session, y, m, d, tr_type, account_id, category_id,
+                                                          threshold, limit, cursor):
+                yield b''.join(to_json(transaction) + b'\n' for transaction in transactions)
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+@router.get('/dashboard')
+@cached
+async def dashboard(y: int, m: Optional[int] = None, db: AsyncSession = Depends(get_db)):
+    return await get_dashboard(db, y, m)
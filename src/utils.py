@@ -1,15 +1,66 @@
+import hashlib
 import os
 from calendar import monthrange
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from typing import Optional
 
-from src.config import DATA_PATH
+from src.config import DATA_PATH, PREPARED_DATA_PATH, PREPARATORY_QUERIES_FILE, COMPILE_INDEX_QUERIES_FILE, \
+    INDEX_QUERIES_FILE, PREPARATION_MODULES, PREPARED_DB_VERSION, MAX_TRANSACTION_AMOUNT_THRESHOLD, \
+    BURN_RATE_AMOUNT_THRESHOLD, EXCHANGE_RATES_FILE, EXCHANGE_RATES_PATH
 
 
 def get_latest_db_file():
     return max([f.path for f in os.scandir(DATA_PATH) if f.path.endswith('.bak')])
 
 
+def get_file_hash(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def get_preparation_version() -> str:
+    # the translation SQL, the python modules that compile the prepared tables and the settings they read
+    source_dir = os.path.dirname(__file__)
+    preparation_files = (PREPARATORY_QUERIES_FILE, COMPILE_INDEX_QUERIES_FILE, INDEX_QUERIES_FILE,
+                         *(os.path.join(source_dir, name) for name in PREPARATION_MODULES))
+    preparation_settings = (PREPARED_DB_VERSION, MAX_TRANSACTION_AMOUNT_THRESHOLD, BURN_RATE_AMOUNT_THRESHOLD)
+    version_hash = hashlib.sha256()
+    for preparation_file in preparation_files:
+        version_hash.update(get_file_hash(preparation_file).encode())
+    version_hash.update(repr(preparation_settings).encode())
+    return version_hash.hexdigest()[:12]
+
+
+def get_rates_version() -> str:
+    # compile_daily_exchange_rates reads the rates file and every cached day of rates
+    rates_files = [EXCHANGE_RATES_FILE] if os.path.isfile(EXCHANGE_RATES_FILE) else []
+    if os.path.isdir(EXCHANGE_RATES_PATH):
+        rates_files += sorted(f.path for f in os.scandir(EXCHANGE_RATES_PATH) if f.name.endswith('.json'))
+    version_hash = hashlib.sha256()
+    for rates_file in rates_files:
+        version_hash.update(f'{os.path.basename(rates_file)}:{get_file_hash(rates_file)}'.encode())
+    return version_hash.hexdigest()[:12]
+
+
+def get_code_version() -> str:
+    version_hash = hashlib.sha256()
+    source_dir = os.path.dirname(__file__)
+    for name in sorted(os.listdir(source_dir)):
+        if name.endswith('.py'):
+            version_hash.update(get_file_hash(os.path.join(source_dir, name)).encode())
+    return version_hash.hexdigest()[:12]
+
+
+def get_latest_prepared_db_file():
+    if not os.path.isdir(PREPARED_DATA_PATH):
+        return None
+
+    # DBs compiled with other exchange rates are still a valid base, the rates are compiled from scratch
+    version = f'-{get_preparation_version()}-'
+    db_files = [f for f in os.scandir(PREPARED_DATA_PATH) if version in f.name and f.name.endswith('.db')]
+    return max(db_files, key=lambda f: f.stat().st_mtime).path if db_files else None
+
+
 def timeframe_to_dates(year: int,
                        month: Optional[int] = None,
                        day: Optional[int] = None) -> tuple[datetime, datetime]:
@@ -37,6 +88,25 @@ def timeframe_to_timestamps(year: int,
     return int(dates[0].timestamp()), int(dates[1].timestamp())
 
 
+def day_start(timestamp: int) -> int:
+    d = datetime.fromtimestamp(timestamp)
+    return int(datetime(d.year, d.month, d.day).timestamp())
+
+
+def get_exchange_rate_date() -> date:
+    now = datetime.now()
+    return now.date() if now.hour > 8 else (now - timedelta(days=1)).date()
+
+
+def encode_cursor(timestamp: int, transaction_id: int) -> str:
+    return f'{timestamp}:{transaction_id}'
+
+
+def decode_cursor(cursor: str) -> tuple[int, int]:
+    timestamp, transaction_id = cursor.split(':')
+    return int(timestamp), int(transaction_id)
+
+
 def savings_separators(year: int, month: Optional[int]):
     separators = {}
     if month:
@@ -58,3 +128,14 @@ def savings_separators(year: int, month: Optional[int]):
         separators['Dec 31'] = datetime(year + 1, 1, 1, 0, 0, 0).timestamp()
 
     return separators
+
+
+def savings_range_separators(from_year: int, to_year: int):
+    separators = {}
+    d = datetime(from_year, 1, 1, 0, 0, 0)
+    end = min(datetime(to_year + 1, 1, 1, 0, 0, 0), datetime.now())
+    while d <= end:
+        separators[d.strftime('%Y-%m-%d')] = d.timestamp()
+        d += timedelta(days=1)
+
+    return separators